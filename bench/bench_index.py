@@ -0,0 +1,60 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+from g1t.core.repository import Repository
+from g1t.core.index import G1tIndex, G1tIndexEntry, read_index, write_index
+
+# Usage: PYTHONPATH=src python bench/bench_index.py [entries]
+
+
+def make_index(count: int) -> G1tIndex:
+    entries = []
+    for i in range(count):
+        entries.append(
+            G1tIndexEntry(
+                ctime=(1700000000 + i, i % 10**9),
+                mtime=(1700000000 + i, i % 10**9),
+                dev=2049,
+                ino=100000 + i,
+                mode_type=0b1000,
+                mode_perms=0o644,
+                uid=1000,
+                gid=1000,
+                fsize=i % 65536,
+                sha=format(i * 2654435761 % 2**160, "040x"),
+                flag_assume_valid=False,
+                flag_stage=False,
+                name=f"src/module{i // 1000:03d}/pkg{i // 100 % 10}/file{i}.py",
+            )
+        )
+    return G1tIndex(entries=entries)
+
+
+def bench(count: int, rounds: int = 5) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = Repository(Path(tmp))
+        repo.gitdir.mkdir()
+        index = make_index(count)
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            write_index(repo, index)
+            best = min(best, time.perf_counter() - start)
+        print(
+            f"write_index: {count} entries in {best:.3f}s ({count / best:,.0f} entries/s)"
+        )
+
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            index = read_index(repo)
+            best = min(best, time.perf_counter() - start)
+        assert len(index.entries) == count
+        print(
+            f"read_index: {count} entries in {best:.3f}s ({count / best:,.0f} entries/s)"
+        )
+
+
+if __name__ == "__main__":
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000)
@@ -1,9 +1,10 @@
 import click
 from g1t.core.repository import Repository
-from g1t.core.object import G1tCommit, G1tTree
+from g1t.core.object import G1tCommit, G1tTree, object_from_raw
 from g1t import cmd
 from configparser import ConfigParser
 from pathlib import Path
+import sys
 from g1t.presentation.converter.commit import commit_converter
 from g1t.presentation.converter.tree import convert_tree
 from g1t.presentation.echo.commit import echo_commit
@@ -37,8 +38,19 @@ def show_ref() -> int:
 
 
 @main.command()
-def status() -> int:
-    cmd.status.cmd_status()
+@click.option(
+    "-j", "--jobs", type=int, help="Files to hash in parallel (default: CPU count)"
+)
+@click.option(
+    "--porcelain",
+    type=click.Choice(["v1", "v2"]),
+    is_flag=False,
+    flag_value="v1",
+    help="Machine-readable output, v1 by default",
+)
+@click.option("-z", "nul", is_flag=True, help="Terminate records with NUL")
+def status(jobs: int | None, porcelain: str | None, nul: bool) -> int:
+    cmd.status.cmd_status(jobs, porcelain, nul)
     return 0
 
 
@@ -66,9 +78,37 @@ def ls_files(verbose: bool) -> int:
 
 
 @main.command()
-@click.argument("sha", type=str)
-def cat_file(sha: str) -> int:
-    obj = cmd.cat_file.cmd_cat_file(sha)
+@click.argument("sha", type=str, required=False)
+@click.option(
+    "--batch",
+    is_flag=True,
+    default=False,
+    help="Print type, size and content of each object named on stdin",
+)
+@click.option(
+    "--batch-check",
+    is_flag=True,
+    default=False,
+    help="Print type and size of each object named on stdin",
+)
+@click.option(
+    "--buffer", is_flag=True, default=False, help="Don't flush after each object"
+)
+def cat_file(sha: str | None, batch: bool, batch_check: bool, buffer: bool) -> int:
+    if batch or batch_check:
+        cmd.cat_file.cmd_cat_file_batch(
+            sys.stdin.buffer, sys.stdout.buffer, contents=batch, buffer=buffer
+        )
+        return 0
+    if sha is None:
+        raise click.UsageError("Missing argument 'SHA'")
+    fmt, _, chunks = cmd.cat_file.cmd_cat_file_stream(sha)
+    if fmt == "blob":
+        # Blobs can be huge: copy them to stdout without buffering it all.
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        return 0
+    obj = object_from_raw(fmt, b"".join(chunks))
     if isinstance(obj, G1tCommit):
         echo_commit(commit_converter(obj))
     elif isinstance(obj, G1tTree):
@@ -123,9 +163,13 @@ def rm(path: list[str]) -> None:
 
 
 @main.command()
+@click.option(
+    "-j", "--jobs", type=int, help="Files to hash in parallel (default: CPU count)"
+)
+@click.option("-u", "--update", is_flag=True, help="Stage changes to all tracked files")
 @click.argument("path", nargs=-1)
-def add(path: list[str]) -> None:
-    cmd.cmd_add([Path(p) for p in path])
+def add(jobs: int | None, update: bool, path: list[str]) -> None:
+    cmd.cmd_add([Path(p) for p in path], jobs, update)
 
 
 @main.command()
@@ -138,3 +182,60 @@ def commit(message: str) -> None:
 @click.option("-c", "--create", type=str, required=True)  # TODO: delete required
 def switch(create: str) -> None:
     cmd.cmd_create_branch(create)
+
+
+@main.command()
+def gc() -> None:
+    cmd.cmd_gc()
+
+
+@main.command()
+@click.option("--window", type=int, help="Number of objects to try as delta base")
+@click.option("--depth", type=int, help="Maximum delta chain length")
+@click.option("--threads", type=int, help="Delta search workers (0: one per CPU)")
+def repack(window: int | None, depth: int | None, threads: int | None) -> None:
+    cmd.cmd_repack(window, depth, threads)
+
+
+@main.command()
+@click.option(
+    "--short", is_flag=True, default=False, help="Shortest unique abbreviation"
+)
+@click.option(
+    "--abbrev", type=int, default=7, help="Minimum length of --short (default 7)"
+)
+@click.argument("name", type=str)
+def rev_parse(short: bool, abbrev: int, name: str) -> None:
+    cmd.cmd_rev_parse(name, abbrev if short else None)
+
+
+@main.group()
+def sparse_checkout() -> None:
+    pass
+
+
+@sparse_checkout.command("set")
+@click.option(
+    "--sparse-index/--no-sparse-index",
+    default=None,
+    help="Collapse the directories outside the cone in the index",
+)
+@click.argument("directory", nargs=-1)
+def sparse_checkout_set(sparse_index: bool | None, directory: list[str]) -> None:
+    cmd.cmd_sparse_checkout_set(list(directory), sparse_index)
+
+
+@sparse_checkout.command("list")
+def sparse_checkout_list() -> None:
+    cmd.cmd_sparse_checkout_list()
+
+
+@sparse_checkout.command("disable")
+def sparse_checkout_disable() -> None:
+    cmd.cmd_sparse_checkout_disable()
+
+
+@main.command("fsmonitor--daemon")
+@click.argument("action", type=click.Choice(["run", "start", "stop", "status"]))
+def fsmonitor_daemon(action: str) -> None:
+    cmd.cmd_fsmonitor_daemon(action)
@@ -1,4 +1,3 @@
 import g1t
-import sys
 
-sys.exit(g1t.__init__())  # type: ignore
+g1t.main(prog_name="g1t")
@@ -10,6 +10,14 @@ from .rm import cmd_rm
 from .add import cmd_add
 from .commit import cmd_commit
 from .switch import cmd_create_branch, cmd_switch_branch
+from .gc import cmd_gc, cmd_repack
+from .rev_parse import cmd_rev_parse
+from .fsmonitor import cmd_fsmonitor_daemon
+from .sparse_checkout import (
+    cmd_sparse_checkout_set,
+    cmd_sparse_checkout_list,
+    cmd_sparse_checkout_disable,
+)
 
 
 __all__ = [
@@ -26,4 +34,11 @@ __all__ = [
     "cmd_status",
     "cmd_create_branch",
     "cmd_switch_branch",
+    "cmd_gc",
+    "cmd_repack",
+    "cmd_rev_parse",
+    "cmd_sparse_checkout_set",
+    "cmd_sparse_checkout_list",
+    "cmd_sparse_checkout_disable",
+    "cmd_fsmonitor_daemon",
 ]
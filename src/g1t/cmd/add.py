@@ -3,6 +3,6 @@ from pathlib import Path
 from g1t.core.index import add
 
 
-def cmd_add(paths: list[Path]) -> None:
+def cmd_add(paths: list[Path], jobs: int | None = None, update: bool = False) -> None:
     repo = find_repository()
-    add(repo, paths)
+    add(repo, paths, workers=jobs, update=update)
@@ -1,10 +1,58 @@
-from g1t.core.object import read_object, G1tCommit, G1tTree, G1tBlob, G1tTag
+from g1t.core.object import (
+    read_object,
+    read_object_info,
+    read_object_stream,
+    resolve_object,
+    G1tCommit,
+    G1tTree,
+    G1tBlob,
+    G1tTag,
+)
 from g1t.core.utils import find_repository
+from typing import BinaryIO, Iterator
 
 
 def cmd_cat_file(sha: str) -> G1tBlob | G1tCommit | G1tTree:
+    # The whole object is read anyway, so its type comes with it.
     repository = find_repository()
     obj = read_object(repository=repository, sha=sha)
     if isinstance(obj, G1tTag):
         raise Exception("Tag object is not supported")
     return obj
+
+
+def cmd_cat_file_stream(sha: str) -> tuple[str, int, Iterator[bytes]]:
+    repository = find_repository()
+    fmt, _ = read_object_info(repository=repository, sha=sha)
+    if fmt == G1tTag.fmt.decode("ascii"):
+        raise Exception("Tag object is not supported")
+    return read_object_stream(repository=repository, sha=sha)
+
+
+def cmd_cat_file_batch(
+    names: BinaryIO, out: BinaryIO, contents: bool = True, buffer: bool = False
+) -> None:
+    # One repository handle (and so one set of caches) for every lookup.
+    repository = find_repository()
+    for line in names:
+        name = line.decode("utf8").strip()
+        candidates = resolve_object(repository, name) if name else []
+        if len(candidates) == 0:
+            out.write(f"{name} missing\n".encode())
+        elif len(candidates) > 1:
+            out.write(f"{name} ambiguous\n".encode())
+        else:
+            sha = candidates[0]
+            if contents:
+                fmt, size, chunks = read_object_stream(repository, sha)
+            else:
+                fmt, size = read_object_info(repository, sha)
+            out.write(f"{sha} {fmt} {size}\n".encode())
+            if contents:
+                for chunk in chunks:
+                    out.write(chunk)
+                out.write(b"\n")
+        # Callers usually wait for each answer before asking the next one.
+        if not buffer:
+            out.flush()
+    out.flush()
@@ -1,5 +1,6 @@
 from g1t.core.utils import find_repository
 from g1t.core.object import find_object, read_object, checkout_tree, G1tCommit, G1tTree
+from g1t.core.sparse import read_sparse_checkout
 from pathlib import Path
 
 
@@ -14,4 +15,5 @@ def cmd_checkout(commit: str, path: Path) -> None:
     if not isinstance(obj, G1tTree):
         raise Exception(f"Commit {commit} is invalid commit")
     path.mkdir(parents=True, exist_ok=True)
-    checkout_tree(repo, obj, path)
+    sparse = read_sparse_checkout(repo)
+    checkout_tree(repo, obj, path, sparse.includes if sparse else None)
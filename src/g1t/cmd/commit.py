@@ -1,5 +1,5 @@
 from g1t.core.utils import find_repository, get_user_from_gitconfig
-from g1t.core.index import read_index
+from g1t.core.index import index_transaction
 from g1t.core.commit import tree_from_index, commit_create
 from g1t.core.object import find_object, G1tCommit
 from g1t.core.branch import get_active_branch
@@ -9,9 +9,10 @@ from datetime import datetime
 
 def cmd_commit(message: str) -> None:
     repo = find_repository()
-    index = read_index(repo)
-    # Create trees, grab back SHA for the root tree.
-    tree = tree_from_index(repo, index)
+    # Create trees, grab back SHA for the root tree. The index is written
+    # back so the next commit can reuse the trees that didn't change.
+    with index_transaction(repo) as index:
+        tree = tree_from_index(repo, index)
 
     # Create the commit object itself
     commit = commit_create(
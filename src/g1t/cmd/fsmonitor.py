@@ -0,0 +1,22 @@
+from g1t.core.utils import find_repository
+from g1t.core.fsmonitor import (
+    G1tFsmonitorDaemon,
+    query_fsmonitor,
+    start_fsmonitor_daemon,
+    stop_fsmonitor_daemon,
+)
+
+
+def cmd_fsmonitor_daemon(action: str) -> None:
+    repo = find_repository()
+    if action == "run":
+        G1tFsmonitorDaemon(repo).serve()
+    elif action == "start":
+        start_fsmonitor_daemon(repo)
+    elif action == "stop":
+        if not stop_fsmonitor_daemon(repo):
+            raise Exception(f"fsmonitor-daemon is not watching '{repo.worktree}'")
+    elif query_fsmonitor(repo, None) is not None:
+        print(f"fsmonitor-daemon is watching '{repo.worktree}'")
+    else:
+        print(f"fsmonitor-daemon is not watching '{repo.worktree}'")
@@ -0,0 +1,32 @@
+from g1t.core.utils import find_repository
+from g1t.core.config import config_get_int
+from g1t.core.repack import repack
+import os
+
+
+def cmd_repack(
+    window: int | None = None, depth: int | None = None, threads: int | None = None
+) -> None:
+    repo = find_repository()
+    if window is None:
+        window = config_get_int(repo.config, "pack", "window", 10)
+    if depth is None:
+        depth = config_get_int(repo.config, "pack", "depth", 50)
+    if threads is None:
+        threads = config_get_int(repo.config, "pack", "threads", 0)
+    # Like git, 0 means one thread per CPU.
+    if threads == 0:
+        threads = os.cpu_count() or 1
+
+    print(f"Delta compression using up to {threads} threads")
+    stats = repack(repo, window=window, depth=depth, workers=threads)
+    rate = stats.objects / stats.seconds if stats.seconds > 0 else 0.0
+    print(
+        f"Total {stats.objects} (delta {stats.deltas}), "
+        f"done in {stats.seconds:.2f}s ({rate:.0f} objects/s)"
+    )
+    print(f"pack-{stats.pack}")
+
+
+def cmd_gc() -> None:
+    cmd_repack()
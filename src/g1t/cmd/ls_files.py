@@ -1,7 +1,12 @@
 from g1t.core.utils import find_repository
 from g1t.core.index import read_index
 
-MODETYPE = {0b1000: "regular file", 0b1010: "symlink", 0b1110: "git link"}
+MODETYPE = {
+    0b1000: "regular file",
+    0b1010: "symlink",
+    0b1110: "git link",
+    0b0100: "sparse directory",
+}
 
 
 def cmd_ls_files(verbose: bool) -> None:
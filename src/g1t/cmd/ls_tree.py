@@ -15,9 +15,13 @@ def ls_tree(repo: Repository, tree: str, recursive: bool, path: Path) -> None:
     if sha is None:
         raise Exception(f"fatal: not a tree object {tree}")
 
+    print_tree(repo, sha, recursive, path)
+
+
+def print_tree(repo: Repository, sha: str, recursive: bool, path: Path) -> None:
     obj = read_object(repo, sha)
     if not isinstance(obj, G1tTree):
-        raise Exception(f"fatal: object {tree} is not a tree")
+        raise Exception(f"fatal: object {sha} is not a tree")
     for leaf in obj.items:
         if len(leaf.mode) == 5:
             obj_type_b = leaf.mode[0:1]
@@ -37,7 +41,9 @@ def ls_tree(repo: Repository, tree: str, recursive: bool, path: Path) -> None:
             case _:
                 raise Exception(f"Unknown object type {obj_type_b!r}")
 
-        if recursive or obj_type == "tree":
-            ls_tree(repo, leaf.sha, recursive, path / leaf.path)
+        # Entry types come from the modes, so subtrees are the only
+        # objects we ever need to read.
+        if recursive and obj_type == "tree":
+            print_tree(repo, leaf.sha, recursive, path / leaf.path)
         else:
-            print(f"{obj_type} {leaf.sha} {leaf.path}")
+            print(f"{obj_type} {leaf.sha} {path / leaf.path}")
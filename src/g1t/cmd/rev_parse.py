@@ -0,0 +1,14 @@
+from g1t.core.utils import find_repository
+from g1t.core.object import find_object
+from g1t.core.lookup import abbreviate_object
+
+
+def cmd_rev_parse(name: str, short: int | None = None) -> str:
+    repo = find_repository()
+    sha = find_object(repo, name)
+    if sha is None:
+        raise Exception(f"No such reference {name}")
+    if short is not None:
+        sha = abbreviate_object(repo, sha, short)
+    print(sha)
+    return sha
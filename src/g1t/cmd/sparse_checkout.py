@@ -0,0 +1,46 @@
+from g1t.core.utils import find_repository
+from g1t.core.config import config_set
+from g1t.core.index import index_transaction
+from g1t.core.sparse import (
+    G1tSparseCheckout,
+    read_sparse_checkout,
+    update_sparse_worktree,
+    write_sparse_checkout,
+)
+import click
+
+
+def cmd_sparse_checkout_set(dirs: list[str], sparse_index: bool | None) -> None:
+    repo = find_repository()
+    sparse = G1tSparseCheckout(dirs)
+    write_sparse_checkout(repo, sparse)
+    config_set(repo, "core", "sparseCheckout", "true")
+    config_set(repo, "core", "sparseCheckoutCone", "true")
+    if sparse_index is not None:
+        config_set(repo, "index", "sparse", "true" if sparse_index else "false")
+    with index_transaction(repo) as index:
+        warnings = update_sparse_worktree(repo, index, sparse)
+    print_warnings(warnings)
+
+
+def cmd_sparse_checkout_list() -> None:
+    repo = find_repository()
+    sparse = read_sparse_checkout(repo)
+    if sparse is None:
+        raise Exception("This worktree is not sparse")
+    for d in sorted(sparse.recursive):
+        print(d[:-1])
+
+
+def cmd_sparse_checkout_disable() -> None:
+    repo = find_repository()
+    config_set(repo, "core", "sparseCheckout", "false")
+    with index_transaction(repo) as index:
+        warnings = update_sparse_worktree(repo, index, None)
+    print_warnings(warnings)
+
+
+def print_warnings(warnings: list[str]) -> None:
+    # On stderr, to keep stdout for output other commands may parse.
+    for warning in warnings:
+        click.echo(f"warning: {warning}", err=True)
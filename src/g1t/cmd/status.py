@@ -1,18 +1,58 @@
 from g1t.core.repository import Repository
 from g1t.core.branch import get_active_branch
-from g1t.core.ignore import read_all_gitignore_config, check_ignore
-from g1t.core.utils import tree_to_dict, find_repository
-from g1t.core.index import G1tIndex, read_index
-from g1t.core.object import hash_object
+from g1t.core.ignore import (
+    read_all_gitignore_config,
+    check_ignore,
+    check_ignore_dir,
+    gitignore_shas,
+    global_ignore_path,
+)
+from g1t.core.utils import find_repository, walk_worktree
+from g1t.core.index import (
+    G1tIndex,
+    G1tIndexEntry,
+    entry_is_racy,
+    entry_stat_matches,
+    get_untracked_cache,
+    index_entry_from_stat,
+    index_transaction,
+    refresh_fsmonitor,
+)
+from g1t.core.untracked import (
+    list_untracked,
+    untracked_cache_ident,
+    update_untracked_cache,
+    validate_untracked_cache,
+)
+from g1t.core.object import G1tTree, find_object, hash_object
+from g1t.core.diff import Side, diff_tree_index, entry_side
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import BinaryIO, Iterator
+import os
+import sys
 
+# A path that differs between HEAD and the index, with both sides, and a
+# path whose file is deleted ("D") or modified ("M") in the worktree.
+StagedChange = tuple[str, Side, Side]
+UnstagedChange = tuple[str, G1tIndexEntry, str]
 
-def cmd_status() -> None:
+
+def cmd_status(
+    jobs: int | None = None, porcelain: str | None = None, nul: bool = False
+) -> None:
     repo = find_repository()
-    index = read_index(repo)
-    cmd_status_branch(repo)
-    cmd_status_head_index(repo, index)
-    cmd_status_index_worktree(repo, index)
+    # The index is only written back if stat data was refreshed or the
+    # untracked cache changed.
+    with index_transaction(repo, optional=True) as index:
+        fsmonitor = refresh_fsmonitor(repo, index)
+        if porcelain is None and not nul:
+            cmd_status_branch(repo)
+            cmd_status_head_index(repo, index)
+            cmd_status_index_worktree(repo, index, fsmonitor, jobs)
+        else:
+            cmd_status_porcelain(repo, index, fsmonitor, jobs, porcelain or "v1", nul)
 
 
 def cmd_status_branch(repo: Repository) -> None:
@@ -25,51 +65,256 @@ def cmd_status_branch(repo: Repository) -> None:
 
 def cmd_status_head_index(repo: Repository, index: G1tIndex) -> None:
     print("Changes to be committed:")
-    head = tree_to_dict(repo, "HEAD", repo.worktree)
-    for entry in index.entries:
-        if entry.name in head:
-            if head[entry.name] != entry.sha:
-                print(f"  (modified) {entry.name}")
-            del head[entry.name]
+    for name, head, staged in head_index_changes(repo, index):
+        if head is None:
+            print(f"  (new file) {name}")
+        elif staged is None:
+            print(f" (deleted) {name}")
         else:
-            print(f"  (new file) {entry.name}")
-
-    for entry in head.keys():
-        print(f" (deleted) {entry}")
+            print(f"  (modified) {name}")
 
 
-def cmd_status_index_worktree(repo: Repository, index: G1tIndex) -> None:
+def cmd_status_index_worktree(
+    repo: Repository,
+    index: G1tIndex,
+    fsmonitor: bool = False,
+    workers: int | None = None,
+) -> None:
     print("Changes not staged for commit:")
-    ignore = read_all_gitignore_config(repo)
-    # TODO: refactor relpath and abs path
-    all_files: list[Path] = list()
-    for root, _, files in repo.worktree.walk():
-        if root == repo.gitdir:
-            continue
-        for relative_path in files:
-            full_path = root / relative_path
-            rel_path = full_path.relative_to(repo.worktree)
-            all_files.append(rel_path)
-
-    for entry in index.entries:
-        full_path = repo.worktree / entry.name
-        if not full_path.exists():
-            print(f"  (deleted) {entry.name}")
+    for name, _, state in index_worktree_changes(repo, index, fsmonitor, workers):
+        if state == "D":
+            print(f"  (deleted) {name}")
         else:
-            stat = full_path.stat()
-            ctime_ns: int = entry.ctime[0] * 10**9 + entry.ctime[1]
-            mtime_ns: int = entry.mtime[0] * 10**9 + entry.mtime[1]
-            if ctime_ns != stat.st_ctime_ns or mtime_ns != stat.st_mtime_ns:
-                print(f"  (modified) {entry.name}")
-                with open(full_path, "rb") as f:
-                    new_sha = hash_object(f, "blob", None)
-                    if entry.sha != new_sha:
-                        print(f"  (modified content) {entry.name}")
-
-        if Path(entry.name) in all_files:
-            all_files.remove(Path(entry.name))
+            print(f"  (modified) {name}")
 
     print("Untracked files:")
-    for path in all_files:
-        if not check_ignore(ignore, path):
-            print(f"  {path}")
+    for path in list_untracked_files(repo, index, fsmonitor):
+        print(f"  {path}")
+
+
+def cmd_status_porcelain(
+    repo: Repository,
+    index: G1tIndex,
+    fsmonitor: bool,
+    workers: int | None,
+    version: str,
+    nul: bool,
+) -> None:
+    # git status --porcelain[=v2] [-z], without the branch header. Each
+    # record is written as soon as both of its sides are known, through
+    # the buffered binary stdout rather than one print() per line.
+    out: BinaryIO = sys.stdout.buffer
+    end = b"\x00" if nul else b"\n"
+    staged = head_index_changes(repo, index)
+    unstaged = index_worktree_changes(repo, index, fsmonitor, workers)
+    for name, x, head, staged_side, y in merge_changes(staged, unstaged):
+        if version == "v1":
+            # v1 shows unchanged sides as spaces, v2 as dots.
+            xy = f"{x}{y} ".replace(".", " ")
+            out.write(xy.encode("ascii") + encode_path(name, nul) + end)
+            continue
+        mode_head, sha_head = head or ("000000", "0" * 40)
+        mode_index, sha_index = staged_side or ("000000", "0" * 40)
+        mode_worktree = "000000" if y == "D" else mode_index
+        out.write(
+            f"1 {x}{y} N... {mode_head} {mode_index} {mode_worktree} "
+            f"{sha_head} {sha_index} ".encode("ascii")
+            + encode_path(name, nul)
+            + end
+        )
+
+    untracked = b"?? " if version == "v1" else b"? "
+    for path in list_untracked_files(repo, index, fsmonitor):
+        out.write(untracked + encode_path(str(path), nul) + end)
+    out.flush()
+
+
+def merge_changes(
+    staged: Iterator[StagedChange], unstaged: Iterator[UnstagedChange]
+) -> Iterator[tuple[str, str, Side, Side, str]]:
+    # Pair both path-ordered streams: each changed path with its staged
+    # status letter, HEAD and index sides, and worktree status letter.
+    next_staged = next(staged, None)
+    next_unstaged = next(unstaged, None)
+    while next_staged is not None or next_unstaged is not None:
+        if next_unstaged is None or (
+            next_staged is not None and next_staged[0] < next_unstaged[0]
+        ):
+            assert next_staged is not None
+            name, head, side = next_staged
+            yield name, staged_letter(head, side), head, side, "."
+            next_staged = next(staged, None)
+        elif next_staged is None or next_unstaged[0] < next_staged[0]:
+            name, entry, state = next_unstaged
+            side = entry_side(entry)
+            yield name, ".", side, side, state
+            next_unstaged = next(unstaged, None)
+        else:
+            name, head, side = next_staged
+            yield name, staged_letter(head, side), head, side, next_unstaged[2]
+            next_staged = next(staged, None)
+            next_unstaged = next(unstaged, None)
+
+
+def staged_letter(head: Side, staged: Side) -> str:
+    if head is None:
+        return "A"
+    if staged is None:
+        return "D"
+    return "M"
+
+
+def encode_path(name: str, nul: bool) -> bytes:
+    # NUL-terminated records need no quoting.
+    return name.encode("utf8") if nul else quote_path(name)
+
+
+def quote_path(name: str) -> bytes:
+    # Like git's core.quotePath: C-quoted if it has special characters.
+    raw = name.encode("utf8")
+    if not any(c < 0x20 or c >= 0x7F or c in b'"\\' for c in raw):
+        return raw
+    quoted = bytearray(b'"')
+    for c in raw:
+        if c in QUOTE_ESCAPES:
+            quoted += b"\\" + QUOTE_ESCAPES[c]
+        elif c < 0x20 or c >= 0x7F:
+            quoted += b"\\%03o" % c
+        else:
+            quoted.append(c)
+    return bytes(quoted + b'"')
+
+
+QUOTE_ESCAPES = {
+    0x07: b"a",
+    0x08: b"b",
+    0x09: b"t",
+    0x0A: b"n",
+    0x0B: b"v",
+    0x0C: b"f",
+    0x0D: b"r",
+    0x22: b'"',
+    0x5C: b"\\",
+}
+
+
+def head_index_changes(repo: Repository, index: G1tIndex) -> Iterator[StagedChange]:
+    # The paths whose mode or SHA differ between HEAD and the index, in
+    # path order, with both sides. Only the directories that changed
+    # since the last commit are read.
+    tree = find_object(repo, "HEAD", obj_type=G1tTree)
+    if tree is None:
+        raise Exception("Not a tree object HEAD")
+    return diff_tree_index(repo, tree, index)
+
+
+def index_worktree_changes(
+    repo: Repository,
+    index: G1tIndex,
+    fsmonitor: bool = False,
+    workers: int | None = None,
+) -> Iterator[UnstagedChange]:
+    # The entries whose file is deleted ("D") or modified ("M"), in index
+    # order, each as soon as it is known. With fsmonitor, the other
+    # entries are known to be unchanged.
+    names = sorted(index.fsmonitor_dirty) if fsmonitor else index.names
+
+    # Like add: hashlib releases the GIL on large buffers, and so does
+    # reading, so threads are enough to use every core. Stat-dirty files
+    # are hashed while the next entries are being stat-ed; results are
+    # reported from the front of the queue, to keep the order.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pending: deque[tuple[str, G1tIndexEntry, os.stat_result | None, Future[str] | None]]
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name in names:
+            entry = index.by_name[name]
+            if entry.flag_skip_worktree:
+                # Outside the sparse-checkout cone: not expected on disk.
+                continue
+            path = repo.worktree / name
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                pending.append((name, entry, None, None))
+            else:
+                if entry_stat_matches(entry, stat) and not entry_is_racy(index, entry):
+                    index.fsmonitor_dirty.discard(name)
+                else:
+                    future = executor.submit(hash_file, path)
+                    pending.append((name, entry, stat, future))
+            while pending and (pending[0][3] is None or pending[0][3].done()):
+                yield from check_hashed_entry(index, *pending.popleft())
+        while pending:
+            yield from check_hashed_entry(index, *pending.popleft())
+
+
+def check_hashed_entry(
+    index: G1tIndex,
+    name: str,
+    entry: G1tIndexEntry,
+    stat: os.stat_result | None,
+    future: Future[str] | None,
+) -> Iterator[UnstagedChange]:
+    if stat is None or future is None:
+        yield name, entry, "D"
+        return
+    new_sha = future.result()
+    if entry.sha != new_sha:
+        yield name, entry, "M"
+        return
+    # Same content: record the new stat data, so that the next status
+    # doesn't hash the file again. Writing the index also makes racy
+    # entries trustworthy.
+    index.add(index_entry_from_stat(name, stat, new_sha))
+    index.modified = True
+    index.fsmonitor_dirty.discard(name)
+
+
+def hash_file(path: Path) -> str:
+    # Unbuffered, so that small files are read in one go and large ones
+    # in big chunks, and with read-ahead for the whole file.
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        sha: str = hash_object(f, "blob", None)
+    return sha
+
+
+def list_untracked_files(
+    repo: Repository, index: G1tIndex, fsmonitor: bool = False
+) -> Iterator[Path]:
+    ignore = None
+
+    def is_ignored(path: str) -> bool:
+        # The ignore rules are only read if some directory has to be listed.
+        # Directories end with "/".
+        nonlocal ignore
+        if ignore is None:
+            ignore = read_all_gitignore_config(repo, index)
+        if path.endswith("/"):
+            return check_ignore_dir(ignore, Path(path))
+        return check_ignore(ignore, Path(path))
+
+    cache = get_untracked_cache(repo, index)
+    if cache is None:
+        for name, _ in walk_worktree(repo.worktree, is_ignored):
+            if name not in index and not is_ignored(name):
+                yield Path(name)
+        return
+
+    exclude_shas = gitignore_shas(index)
+    validate_untracked_cache(
+        cache,
+        untracked_cache_ident(repo.worktree),
+        repo.gitdir / "info/exclude",
+        global_ignore_path(),
+        exclude_shas,
+    )
+    if update_untracked_cache(
+        cache, repo.worktree, index.by_name, is_ignored, exclude_shas, fsmonitor
+    ):
+        index.modified = True
+    for name in list_untracked(cache):
+        yield Path(name)
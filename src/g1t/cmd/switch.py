@@ -9,6 +9,7 @@ from g1t.core.branch import (
     apply_changes,
     update_index,
 )
+from g1t.core.sparse import read_sparse_checkout
 
 
 def cmd_create_branch(branch_name: str) -> None:
@@ -42,6 +43,7 @@ def cmd_switch_branch(branch_name: str) -> None:
 
     diff = tree_diff(repository, from_tree_sha, to_tree_sha)
 
-    apply_changes(repository, diff)
-    update_index(repository, diff)
+    sparse = read_sparse_checkout(repository)
+    apply_changes(repository, diff, sparse)
+    update_index(repository, diff, sparse)
     change_head_pointing_ref(repository, branch_name)
@@ -1,8 +1,14 @@
 from g1t.core.repository import Repository
-from g1t.core.object import G1tCommit, find_object, G1tBlob
-from g1t.core.index import rm, add
+from g1t.core.object import G1tCommit, find_object, checkout_blob
+from g1t.core.index import index_transaction, index_entry_from_stat
+from g1t.core.config import config_get_bool
+from g1t.core.sparse import (
+    G1tSparseCheckout,
+    collapse_index,
+    expand_index,
+    skip_worktree_entry,
+)
 from g1t.core.utils import tree_to_dict
-from pathlib import Path
 
 
 TreeDiff = dict[str, tuple[str | None, str | None]]
@@ -54,8 +60,13 @@ def tree_diff(repo: Repository, a_sha: str, b_sha: str) -> TreeDiff:
     return diff
 
 
-def apply_changes(repo: Repository, change: TreeDiff) -> None:
+def apply_changes(
+    repo: Repository, change: TreeDiff, sparse: G1tSparseCheckout | None = None
+) -> None:
+    # Paths outside the sparse-checkout cone are not in the worktree.
     for path, (a_sha, b_sha) in change.items():
+        if sparse is not None and not sparse.includes(path):
+            continue
         if a_sha is None and b_sha is None:
             raise Exception(f"Both sha are None for {path}")
         elif b_sha is None:
@@ -68,21 +79,32 @@ def apply_changes(repo: Repository, change: TreeDiff) -> None:
 
 
 def create_new_file(repo: Repository, path: str, sha: str) -> None:
-    obj = find_object(repo, sha, G1tBlob)
-    if isinstance(obj, G1tBlob):
-        with open(repo.worktree / path, "wb") as f:
-            f.write(obj.blobdata)
+    dst = repo.worktree / path
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    checkout_blob(repo, sha, dst)
 
 
 def delete_file(repo: Repository, path: str) -> None:
     (repo.worktree / path).unlink()
 
 
-def update_index(repo: Repository, change: TreeDiff) -> None:
-    for path, (a_sha, b_sha) in change.items():
-        if a_sha is None:
-            add(repo, [Path(path)])
-        elif b_sha is None:
-            rm(repo, [Path(path)], delete=False)
-        else:
-            add(repo, [Path(path)])
+def update_index(
+    repo: Repository, change: TreeDiff, sparse: G1tSparseCheckout | None = None
+) -> None:
+    # apply_changes has just written every new blob, so the index entries
+    # come straight from stat without hashing the files again. Only the
+    # sparse directories holding a change are expanded.
+    with index_transaction(repo) as index:
+        expand_index(repo, index, change.keys())
+        for path, (_, b_sha) in change.items():
+            if b_sha is None:
+                index.remove(path)
+            elif sparse is not None and not sparse.includes(path):
+                index.add(skip_worktree_entry(path, b_sha))
+            else:
+                stat = (repo.worktree / path).stat()
+                index.add(index_entry_from_stat(path, stat, b_sha))
+        if sparse is not None and config_get_bool(
+            repo.config, "index", "sparse", False
+        ):
+            collapse_index(repo, index, sparse)
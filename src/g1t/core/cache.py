@@ -0,0 +1,47 @@
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class G1tLRUCache(object):
+    def __init__(self, limit: int) -> None:
+        # `limit` is a budget in bytes, not a number of entries.
+        self.limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.items
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        if size > self.limit:
+            return
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+        self.items[key] = (value, size)
+        self.size += size
+        while self.size > self.limit:
+            _, (_, evicted_size) = self.items.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self) -> None:
+        self.items.clear()
+        self.size = 0
@@ -0,0 +1,61 @@
+class G1tCacheTree(object):
+    # The index "TREE" extension: the tree SHA of each directory, as of
+    # the last time a tree was written from the index. A node with
+    # entry_count -1 is invalid and has to be rebuilt.
+    def __init__(self, entry_count: int = -1, sha: str | None = None) -> None:
+        self.entry_count = entry_count
+        self.sha = sha
+        self.subtrees: dict[str, "G1tCacheTree"] = {}
+
+    def is_valid(self) -> bool:
+        return self.entry_count >= 0 and self.sha is not None
+
+    def invalidate(self, path: str) -> None:
+        # A change to path invalidates every directory from the root down
+        # to the one holding it. Siblings stay valid.
+        node = self
+        node.entry_count = -1
+        node.sha = None
+        for part in path.split("/")[:-1]:
+            child = node.subtrees.get(part)
+            if child is None:
+                return
+            node = child
+            node.entry_count = -1
+            node.sha = None
+
+
+def parse_cache_tree(data: bytes) -> G1tCacheTree:
+    _, tree, _ = parse_one_cache_tree(data, 0)
+    return tree
+
+
+def parse_one_cache_tree(data: bytes, start: int) -> tuple[str, G1tCacheTree, int]:
+    # "<name>\0<entry count> <subtree count>\n[<sha>]", followed by the
+    # subtrees. Invalid nodes have no SHA.
+    nul = data.index(b"\x00", start)
+    name = data[start:nul].decode("utf8")
+    newline = data.index(b"\n", nul)
+    entry_count, subtree_count = (int(n) for n in data[nul + 1 : newline].split(b" "))
+    pos = newline + 1
+
+    tree = G1tCacheTree(entry_count)
+    if entry_count >= 0:
+        tree.sha = data[pos : pos + 20].hex()
+        pos += 20
+    for _ in range(subtree_count):
+        child_name, child, pos = parse_one_cache_tree(data, pos)
+        tree.subtrees[child_name] = child
+    return name, tree, pos
+
+
+def serialize_cache_tree(tree: G1tCacheTree, name: str = "") -> bytes:
+    sha = tree.sha if tree.is_valid() else None
+    entry_count = tree.entry_count if sha is not None else -1
+    ret = name.encode("utf8") + b"\x00"
+    ret += f"{entry_count} {len(tree.subtrees)}\n".encode("ascii")
+    if sha is not None:
+        ret += bytes.fromhex(sha)
+    for child_name in sorted(tree.subtrees):
+        ret += serialize_cache_tree(tree.subtrees[child_name], child_name)
+    return ret
@@ -1,80 +1,81 @@
 from g1t.core.repository import Repository
-from g1t.core.index import G1tIndex, G1tIndexEntry
+from g1t.core.index import G1tIndex
+from g1t.core.cache_tree import G1tCacheTree
 from g1t.core.object import G1tTree, G1tTreeLeaf, write_object, G1tCommit
-import os
-
-
-def tree_from_index(repo: Repository, index: G1tIndex):
-    contents = dict()
-    contents[""] = list()
-
-    # Enumerate entries, and turn them into a dictionary where keys
-    # are directories, and values are lists of directory contents.
-    for entry in index.entries:
-        dirname = os.path.dirname(entry.name)
-
-        # We create all dictionary entries up to root ("").  We need
-        # them *all*, because even if a directory holds no files it
-        # will contain at least a tree.
-        key = dirname
-        while key != "":
-            if key not in contents:
-                contents[key] = list()
-            key = os.path.dirname(key)
-
-        # For now, simply store the entry in the list.
-        contents[dirname].append(entry)
-
-    # Get keys (= directories) and sort them by length, descending.
-    # This means that we'll always encounter a given path before its
-    # parent, which is all we need, since for each directory D we'll
-    # need to modify its parent P to add D's tree.
-    sorted_paths = sorted(contents.keys(), key=len, reverse=True)
-
-    # This variable will store the current tree's SHA-1.  After we're
-    # done iterating over our dict, it will contain the hash for the
-    # root tree.
-    sha = None
-
-    # We ge through the sorted list of paths (dict keys)
-    for path in sorted_paths:
-        # Prepare a new, empty tree object
-        tree = G1tTree(None)
-
-        # Add each entry to our new tree, in turn
-        for entry in contents[path]:
-            # An entry can be a normal GitIndexEntry read from the
-            # index, or a tree we've created.
-            if isinstance(entry, G1tIndexEntry):  # Regular entry (a file)
-                # We transcode the mode: the entry stores it as integers,
-                # we need an octal ASCII representation for the tree.
-                leaf_mode = "{:02o}{:04o}".format(
-                    entry.mode_type, entry.mode_perms
-                ).encode("ascii")
-                leaf = G1tTreeLeaf(
-                    mode=leaf_mode, path=os.path.basename(entry.name), sha=entry.sha
-                )
-            else:  # Tree.  We've stored it as a pair: (basename, SHA)
-                leaf = G1tTreeLeaf(mode=b"040000", path=entry[0], sha=entry[1])
-
-            tree.items.append(leaf)
-
-        # Write the new tree object to the store.
-        sha = write_object(tree, repo)
-
-        # Add the new tree hash to the current dictionary's parent, as
-        # a pair (basename, SHA)
-        parent = os.path.dirname(path)
-        base = os.path.basename(
-            path
-        )  # The name without the path, eg main.go for src/main.go
-        contents[parent].append((base, sha))
-
-    return sha
+import bisect
+
+
+def tree_from_index(repo: Repository, index: G1tIndex) -> str:
+    # Write the trees for the index and return the root tree's SHA.
+    # Directories whose cached tree in index.cache_tree is still valid
+    # are not rebuilt; the cache is updated with everything written, so
+    # the caller should write the index back.
+    if index.cache_tree is None:
+        index.cache_tree = G1tCacheTree()
+    names = index.names
+    return update_cache_tree(repo, index, index.cache_tree, names, 0, len(names), "")
+
+
+def update_cache_tree(
+    repo: Repository,
+    index: G1tIndex,
+    node: G1tCacheTree,
+    names: list[str],
+    start: int,
+    end: int,
+    prefix: str,
+) -> str:
+    # names[start:end] are all the index entries under prefix ("" or
+    # "dir/"). In index order, the entries of a subdirectory are
+    # contiguous, and they come where git expects the subtree.
+    if node.is_valid() and node.entry_count == end - start:
+        assert node.sha is not None
+        return node.sha
+    if prefix and names[start] == prefix:
+        # A sparse directory entry: the whole directory is that one tree.
+        node.subtrees = {}
+        node.entry_count = 1
+        node.sha = index.by_name[prefix].sha
+        index.modified = True
+        return node.sha
+
+    tree = G1tTree(None)
+    subtrees: dict[str, G1tCacheTree] = {}
+    i = start
+    while i < end:
+        name = names[i][len(prefix) :]
+        slash = name.find("/")
+        if slash == -1:
+            entry = index.by_name[names[i]]
+            # We transcode the mode: the entry stores it as integers,
+            # we need an octal ASCII representation for the tree.
+            leaf_mode = "{:02o}{:04o}".format(entry.mode_type, entry.mode_perms)
+            tree.items.append(
+                G1tTreeLeaf(mode=leaf_mode.encode("ascii"), path=name, sha=entry.sha)
+            )
+            i += 1
+        else:
+            dirname = name[:slash]
+            # "0" sorts right after "/", so this finds the end of dirname/.
+            j = bisect.bisect_left(names, prefix + dirname + "0", i, end)
+            child = node.subtrees.get(dirname) or G1tCacheTree()
+            sha = update_cache_tree(
+                repo, index, child, names, i, j, prefix + dirname + "/"
+            )
+            subtrees[dirname] = child
+            tree.items.append(G1tTreeLeaf(mode=b"040000", path=dirname, sha=sha))
+            i = j
+
+    # Directories that no longer exist are dropped from the cache.
+    index.modified = True
+    node.subtrees = subtrees
+    node.entry_count = end - start
+    node.sha = write_object(tree, repo)
+    return node.sha
 
 
 def commit_create(
-    repo: Repository, tree: G1tTree, parent, author, timestamp, message
+    repo: Repository, tree: str, parent, author, timestamp, message
 ) -> str:
     commit = G1tCommit()  # Create the new commit object.
     commit.kvlm[b"tree"] = tree.encode("ascii")
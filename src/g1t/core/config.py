@@ -18,3 +18,72 @@ def gitconfig_read(repo: Repository):
     config = configparser.ConfigParser()
     config.read(configfiles)
     return config
+
+
+def config_get_int(
+    config: configparser.ConfigParser, section: str, option: str, default: int
+) -> int:
+    value = config.get(section, option, fallback=None)
+    if value is None:
+        return default
+    # Like git, accept k/m/g unit suffixes.
+    value = value.strip().lower()
+    unit = {"k": 1024, "m": 1024**2, "g": 1024**3}.get(value[-1:], 1)
+    if unit != 1:
+        value = value[:-1]
+    return int(value) * unit
+
+
+def config_set(repo: Repository, section: str, option: str, value: str) -> None:
+    # Only the repository's own config file is rewritten.
+    if not repo.config.has_section(section):
+        repo.config.add_section(section)
+    repo.config.set(section, option, value)
+    with open(repo.gitdir / "config", "w") as f:
+        repo.config.write(f)
+
+
+def config_get_bool(
+    config: configparser.ConfigParser, section: str, option: str, default: bool
+) -> bool:
+    return config.getboolean(section, option, fallback=default)
+
+
+FSYNC_AGGREGATES = {
+    "objects": {"loose-object", "pack"},
+    "derived-metadata": {"pack-metadata", "commit-graph"},
+    "committed": {"loose-object", "pack", "reference"},
+    "added": {"loose-object", "pack", "reference", "index"},
+    "all": {
+        "loose-object",
+        "pack",
+        "pack-metadata",
+        "commit-graph",
+        "index",
+        "reference",
+    },
+}
+# Same as git: packs and refs, but neither loose objects nor the index.
+FSYNC_DEFAULT = {"pack", "reference"}
+
+
+def config_get_fsync(config: configparser.ConfigParser, component: str) -> bool:
+    # core.fsync is a comma separated list of components to fsync, where
+    # "-component" removes a component again.
+    value = config.get("core", "fsync", fallback=None)
+    if value is None:
+        return component in FSYNC_DEFAULT
+    components: set[str] = set()
+    for name in value.split(","):
+        name = name.strip().lower()
+        if name == "none":
+            components = set()
+            continue
+        remove = name.startswith("-")
+        name = name.removeprefix("-")
+        names = FSYNC_AGGREGATES.get(name, {name})
+        if remove:
+            components -= names
+        else:
+            components |= names
+    return component in components
@@ -0,0 +1,160 @@
+from g1t.core.repository import Repository
+from g1t.core.cache_tree import G1tCacheTree
+from g1t.core.index import G1tIndex, G1tIndexEntry
+from g1t.core.object import G1tTree, G1tTreeLeaf, read_object
+from typing import Iterator
+import bisect
+
+# One side of a change: mode and SHA, or None where the path is missing.
+Side = tuple[str, str] | None
+
+
+def entry_side(entry: G1tIndexEntry) -> tuple[str, str]:
+    return f"{entry.mode_type:o}{entry.mode_perms:04o}", entry.sha
+
+
+def leaf_side(leaf: G1tTreeLeaf) -> tuple[str, str]:
+    return leaf.mode.decode("ascii"), leaf.sha
+
+
+def is_tree_leaf(leaf: G1tTreeLeaf) -> bool:
+    return leaf.mode.startswith(b"04")
+
+
+def leaf_key(leaf: G1tTreeLeaf) -> str:
+    # Where the leaf's paths sort: a directory "a" as "a/".
+    return leaf.path + "/" if is_tree_leaf(leaf) else leaf.path
+
+
+def tree_leaves(repo: Repository, sha: str | None) -> list[G1tTreeLeaf]:
+    # In git's tree order, which for a directory is the order of its paths.
+    if sha is None:
+        return []
+    obj = read_object(repo, sha)
+    if not isinstance(obj, G1tTree):
+        raise Exception(f"fatal: object {sha} is not a tree")
+    return sorted(obj.items, key=leaf_key)
+
+
+def diff_trees(
+    repo: Repository, old: str | None, new: str | None, prefix: str = ""
+) -> Iterator[tuple[str, Side, Side]]:
+    # The files that differ between two trees, in path order. Subtrees
+    # with the same SHA are equal, and are not read.
+    if old == new:
+        return
+    old_leaves = tree_leaves(repo, old)
+    new_leaves = tree_leaves(repo, new)
+    i = j = 0
+    while i < len(old_leaves) or j < len(new_leaves):
+        old_key = leaf_key(old_leaves[i]) if i < len(old_leaves) else None
+        new_key = leaf_key(new_leaves[j]) if j < len(new_leaves) else None
+        if new_key is None or (old_key is not None and old_key < new_key):
+            yield from diff_leaves(repo, old_leaves[i], None, prefix)
+            i += 1
+        elif old_key is None or new_key < old_key:
+            yield from diff_leaves(repo, None, new_leaves[j], prefix)
+            j += 1
+        else:
+            yield from diff_leaves(repo, old_leaves[i], new_leaves[j], prefix)
+            i += 1
+            j += 1
+
+
+def diff_leaves(
+    repo: Repository,
+    old: G1tTreeLeaf | None,
+    new: G1tTreeLeaf | None,
+    prefix: str,
+) -> Iterator[tuple[str, Side, Side]]:
+    # Both are files or both are trees when given together: a file and a
+    # directory of the same name sort differently.
+    leaf = old or new
+    assert leaf is not None
+    if is_tree_leaf(leaf):
+        yield from diff_trees(
+            repo,
+            old.sha if old else None,
+            new.sha if new else None,
+            prefix + leaf.path + "/",
+        )
+        return
+    old_side = leaf_side(old) if old else None
+    new_side = leaf_side(new) if new else None
+    if old_side != new_side:
+        yield prefix + leaf.path, old_side, new_side
+
+
+def diff_tree_index(
+    repo: Repository, tree: str | None, index: G1tIndex
+) -> Iterator[tuple[str, Side, Side]]:
+    # The files that differ between a tree (HEAD's, usually) and the
+    # index, in path order, merging the tree's leaves with the index
+    # entries directory by directory. A directory is skipped without
+    # reading its tree if the cache-tree has the same SHA for it, and
+    # sparse directory entries are compared tree to tree.
+    names = index.names
+    node = index.cache_tree or G1tCacheTree()
+    return diff_tree_index_dir(repo, tree, index, node, names, 0, len(names), "")
+
+
+def diff_tree_index_dir(
+    repo: Repository,
+    tree: str | None,
+    index: G1tIndex,
+    node: G1tCacheTree,
+    names: list[str],
+    start: int,
+    end: int,
+    prefix: str,
+) -> Iterator[tuple[str, Side, Side]]:
+    # names[start:end] are all the index entries under prefix ("" or
+    # "dir/"), and tree its tree, if any. Like update_cache_tree.
+    if node.is_valid() and node.entry_count == end - start and node.sha == tree:
+        return
+    if prefix and start < end and names[start] == prefix:
+        yield from diff_trees(repo, tree, index.by_name[prefix].sha, prefix)
+        return
+
+    leaves = tree_leaves(repo, tree)
+    k = 0
+    i = start
+    while i < end or k < len(leaves):
+        leaf = leaves[k] if k < len(leaves) else None
+        key = leaf_key(leaf) if leaf else None
+        if i < end:
+            name = names[i][len(prefix) :]
+            slash = name.find("/")
+            index_key = name if slash == -1 else name[: slash + 1]
+        else:
+            index_key = None
+
+        if index_key is None or (key is not None and key < index_key):
+            assert leaf is not None
+            yield from diff_leaves(repo, leaf, None, prefix)
+            k += 1
+            continue
+        matched = leaf if key == index_key else None
+        if matched is not None:
+            k += 1
+        if not index_key.endswith("/"):
+            side = entry_side(index.by_name[names[i]])
+            head = leaf_side(matched) if matched else None
+            if head != side:
+                yield names[i], head, side
+            i += 1
+            continue
+        # "0" sorts right after "/", so this finds the end of dirname/.
+        j = bisect.bisect_left(names, prefix + index_key[:-1] + "0", i, end)
+        child = node.subtrees.get(index_key[:-1]) or G1tCacheTree()
+        yield from diff_tree_index_dir(
+            repo,
+            matched.sha if matched else None,
+            index,
+            child,
+            names,
+            i,
+            j,
+            prefix + index_key,
+        )
+        i = j
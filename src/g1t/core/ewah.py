@@ -0,0 +1,83 @@
+import struct
+from typing import Iterable
+
+# git's EWAH bitmaps: 64-bit words, where each "running length word" (RLW)
+# says how many clean words (all 0 or all 1) follow, and then how many
+# literal words. On disk: bit count, word count, words, and the position
+# of the last RLW.
+EWAH_HEADER = struct.Struct(">II")
+EWAH_RLW_POSITION = struct.Struct(">I")
+EWAH_FULL_WORD = (1 << 64) - 1
+EWAH_MAX_RUNNING_LENGTH = (1 << 32) - 1
+EWAH_MAX_LITERAL_WORDS = (1 << 31) - 1
+
+
+def ewah_serialize(positions: Iterable[int], bit_size: int) -> bytes:
+    words = [0] * ((bit_size + 63) // 64)
+    for pos in positions:
+        words[pos >> 6] |= 1 << (pos & 63)
+
+    out: list[int] = []
+    rlw = 0
+    i = 0
+    while i < len(words) or not out:
+        running_bit = 0
+        running_length = 0
+        if i < len(words) and words[i] in (0, EWAH_FULL_WORD):
+            clean = words[i]
+            running_bit = 1 if clean else 0
+            while (
+                i < len(words)
+                and words[i] == clean
+                and running_length < EWAH_MAX_RUNNING_LENGTH
+            ):
+                running_length += 1
+                i += 1
+        literals: list[int] = []
+        while (
+            i < len(words)
+            and words[i] not in (0, EWAH_FULL_WORD)
+            and len(literals) < EWAH_MAX_LITERAL_WORDS
+        ):
+            literals.append(words[i])
+            i += 1
+        rlw = len(out)
+        out.append(running_bit | running_length << 1 | len(literals) << 33)
+        out.extend(literals)
+
+    return (
+        EWAH_HEADER.pack(bit_size, len(out))
+        + struct.pack(f">{len(out)}Q", *out)
+        + EWAH_RLW_POSITION.pack(rlw)
+    )
+
+
+def ewah_deserialize(data: bytes, offset: int = 0) -> tuple[list[int], int, int]:
+    # Returns the set bit positions, the bitmap size in bits, and the
+    # offset just past the bitmap.
+    bit_size, word_count = EWAH_HEADER.unpack_from(data, offset)
+    offset += EWAH_HEADER.size
+    words = struct.unpack_from(f">{word_count}Q", data, offset)
+    offset += 8 * word_count + EWAH_RLW_POSITION.size
+
+    positions: list[int] = []
+    word = 0
+    i = 0
+    while i < word_count:
+        rlw = words[i]
+        i += 1
+        running_length = (rlw >> 1) & EWAH_MAX_RUNNING_LENGTH
+        if rlw & 1:
+            positions.extend(range(word * 64, (word + running_length) * 64))
+        word += running_length
+        for literal in words[i : i + (rlw >> 33)]:
+            while literal:
+                low = literal & -literal
+                positions.append(word * 64 + low.bit_length() - 1)
+                literal ^= low
+            word += 1
+        i += rlw >> 33
+
+    if positions and positions[-1] >= bit_size:
+        positions = [pos for pos in positions if pos < bit_size]
+    return positions, bit_size, offset
@@ -0,0 +1,271 @@
+from g1t.core.repository import Repository
+from g1t.core.ewah import ewah_deserialize, ewah_serialize
+import ctypes
+import ctypes.util
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+# Linux inotify(7), see <sys/inotify.h>.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+# Not git's socket: the protocol is g1t's own.
+FSMONITOR_SOCKET = "g1t-fsmonitor.ipc"
+FSMONITOR_TIMEOUT = 5
+# A changed path meaning "everything may have changed".
+FSMONITOR_TRIVIAL = "/"
+# Past this many changed paths the daemon forgets them all, and answers
+# older tokens with FSMONITOR_TRIVIAL.
+FSMONITOR_MAX_CHANGES = 1024 * 1024
+# The index "FSMN" extension: version, token, and a bitmap of the entries
+# that have to be checked.
+FSMONITOR_VERSION = 2
+FSMONITOR_HEADER = struct.Struct(">I")
+
+
+class G1tFsmonitorDaemon(object):
+    # Watches every directory of the worktree and remembers which paths
+    # changed when. Clients send the token of their last query and get
+    # back a new token and the paths changed in between. Directories are
+    # reported with a trailing "/", for everything under them.
+    def __init__(self, repo: Repository) -> None:
+        self.repo = repo
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptor to directory ("" or "dir/"), and back.
+        self.dirs: dict[int, str] = {}
+        self.watches: dict[str, int] = {}
+        # Tokens are "<daemon id>:<seq>". A token from another daemon,
+        # or older than the changes still known, gets a trivial answer.
+        self.id = f"g1t-{os.getpid()}-{time.time_ns()}"
+        self.seq = 0
+        self.oldest_seq = 0
+        # Path to the seq of its last change.
+        self.changes: dict[str, int] = {}
+        self.running = True
+
+    def watch(self, prefix: str) -> None:
+        path = self.repo.worktree / prefix
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+        if wd < 0:
+            # Gone already, or not a directory.
+            return
+        self.dirs[wd] = prefix
+        self.watches[prefix] = wd
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name == ".git" and not prefix:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        self.watch(prefix + entry.name + "/")
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+
+    def unwatch(self, prefix: str) -> None:
+        for path in [p for p in self.watches if p.startswith(prefix)]:
+            wd = self.watches.pop(path)
+            self.dirs.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self) -> None:
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\x00"))
+                pos += length
+                self.handle_event(wd, mask, name)
+
+    def handle_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost: no token handed out so far can be trusted.
+            self.forget_changes()
+            return
+        prefix = self.dirs.get(wd)
+        if prefix is None:
+            return
+        if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+            # The parent directory reports the change itself.
+            if not prefix:
+                self.running = False
+            return
+        if not prefix and name == ".git":
+            return
+
+        path = prefix + name
+        if mask & IN_ISDIR:
+            path += "/"
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.unwatch(path)
+            else:
+                # Its own metadata: what is in it is reported separately.
+                return
+        self.changes[path] = self.seq
+        if len(self.changes) > FSMONITOR_MAX_CHANGES:
+            self.forget_changes()
+
+    def forget_changes(self) -> None:
+        self.changes.clear()
+        self.oldest_seq = self.seq
+
+    def answer(self, token: str) -> tuple[str, list[str]]:
+        # Everything that happened before the query is in the queue.
+        self.read_events()
+        daemon_id, _, seq = token.rpartition(":")
+        if daemon_id != self.id or not seq.isdigit() or int(seq) < self.oldest_seq:
+            paths = [FSMONITOR_TRIVIAL]
+        else:
+            paths = [p for p, s in self.changes.items() if s > int(seq)]
+        token = f"{self.id}:{self.seq}"
+        self.seq += 1
+        return token, paths
+
+    def handle_client(self, conn: socket.socket) -> None:
+        with conn:
+            conn.settimeout(FSMONITOR_TIMEOUT)
+            request = b""
+            while not request.endswith(b"\n"):
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            command = request[:-1].decode("utf8")
+            if command == "quit":
+                self.running = False
+                conn.sendall(b"\x00")
+                return
+            token, paths = self.answer(command)
+            conn.sendall(b"".join(os.fsencode(p) + b"\x00" for p in [token, *paths]))
+
+    def serve(self) -> None:
+        path = self.repo.gitdir / FSMONITOR_SOCKET
+        if query_fsmonitor(self.repo, None) is not None:
+            raise Exception("The fsmonitor daemon is already running")
+        path.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(os.fsencode(path))
+            # Clients connecting while the worktree is being watched wait
+            # in the backlog, so no token predates the watches.
+            server.listen(16)
+            self.watch("")
+            while self.running:
+                readable, _, _ = select.select([self.fd, server], [], [])
+                if self.fd in readable:
+                    self.read_events()
+                if server in readable:
+                    self.handle_client(server.accept()[0])
+        finally:
+            server.close()
+            path.unlink(missing_ok=True)
+            os.close(self.fd)
+
+
+def query_fsmonitor(
+    repo: Repository, token: str | None
+) -> tuple[str, list[str]] | None:
+    # The daemon's new token and the paths changed since token, or None
+    # if no daemon is running.
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(FSMONITOR_TIMEOUT)
+            s.connect(os.fsencode(repo.gitdir / FSMONITOR_SOCKET))
+            s.sendall((token or "").encode("utf8") + b"\n")
+            chunks = []
+            while chunk := s.recv(64 * 1024):
+                chunks.append(chunk)
+    except OSError:
+        return None
+    response = b"".join(chunks).split(b"\x00")[:-1]
+    if not response:
+        return None
+    return response[0].decode("utf8"), [os.fsdecode(p) for p in response[1:]]
+
+
+def start_fsmonitor_daemon(repo: Repository) -> None:
+    # In the background, for the next commands: this one scans anyway.
+    if sys.platform != "linux":
+        return
+    subprocess.Popen(
+        [sys.executable, "-m", "g1t", "fsmonitor--daemon", "run"],
+        cwd=repo.worktree,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def stop_fsmonitor_daemon(repo: Repository) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(FSMONITOR_TIMEOUT)
+            s.connect(os.fsencode(repo.gitdir / FSMONITOR_SOCKET))
+            s.sendall(b"quit\n")
+            s.recv(1)
+    except OSError:
+        return False
+    return True
+
+
+def parse_fsmonitor(data: bytes) -> tuple[str | None, list[int]]:
+    # Returns the token and the positions of the entries to check.
+    (version,) = FSMONITOR_HEADER.unpack_from(data, 0)
+    if version != FSMONITOR_VERSION:
+        # Version 1 is for hooks, which g1t doesn't run.
+        return None, []
+    nul = data.index(b"\x00", FSMONITOR_HEADER.size)
+    token = data[FSMONITOR_HEADER.size : nul].decode("utf8")
+    # The bitmap is preceded by its size.
+    positions, _, _ = ewah_deserialize(data, nul + 1 + FSMONITOR_HEADER.size)
+    return token, positions
+
+
+def serialize_fsmonitor(token: str, positions: list[int]) -> bytes:
+    bitmap = ewah_serialize(positions, positions[-1] + 1 if positions else 0)
+    return (
+        FSMONITOR_HEADER.pack(FSMONITOR_VERSION)
+        + token.encode("utf8")
+        + b"\x00"
+        + FSMONITOR_HEADER.pack(len(bitmap))
+        + bitmap
+    )
@@ -1,7 +1,7 @@
 import os
 from pathlib import Path
 from g1t.core.repository import Repository
-from g1t.core.index import read_index
+from g1t.core.index import G1tIndex, read_index
 from g1t.core.object import read_object, G1tBlob
 from fnmatch import fnmatch
 
@@ -47,17 +47,23 @@ def parse_git_ignore(lines: list[str]) -> list[ContentsAndIgnoreFlag]:
     return ret
 
 
-def read_all_gitignore_config(repo: Repository) -> G1tIgnore:
+def global_ignore_path() -> Path:
+    global_config = Path.home() / ".config"
+    if "XDG_CONFIG_HOME" in os.environ:
+        global_config = Path(os.environ["XDG_CONFIG_HOME"])
+    return global_config / "g1t" / "ignore"
+
+
+def read_all_gitignore_config(
+    repo: Repository, index: G1tIndex | None = None
+) -> G1tIgnore:
     ignore = G1tIgnore(scoped=dict(), global_ignore=[])
     local_config = repo.gitdir / "info/exclude"
     if local_config.exists():
         with open(local_config) as f:
             ignore.global_ignore.append(parse_git_ignore(f.readlines()))
 
-    global_config = Path.home() / ".config"
-    if "XDG_CONFIG_HOME" in os.environ:
-        global_config = Path(os.environ["XDG_CONFIG_HOME"])
-    global_config = global_config / "g1t" / "ignore"
+    global_config = global_ignore_path()
     if global_config.exists():
         with open(global_config) as f:
             ignore.global_ignore.append(parse_git_ignore(f.readlines()))
@@ -65,18 +71,27 @@ def read_all_gitignore_config(repo: Repository) -> G1tIgnore:
     ignore.global_ignore.append([(".git/**", True)])
 
     # TODO: why does we read .gitignore from index file?
-    index = read_index(repo)
-    for entry in index.entries:
-        if entry.name == ".gitignore" or entry.name.endswith("/.gitignore"):
-            obj = read_object(repo, entry.sha)
-            if not isinstance(obj, G1tBlob):
-                raise Exception(f"Expected blob, got {obj.__class__.__name__}")
-            lines = obj.blobdata.decode("utf8").splitlines()
-            ignore.scoped[os.path.dirname(entry.name)] = parse_git_ignore(lines)
+    if index is None:
+        index = read_index(repo)
+    for name, sha in gitignore_shas(index).items():
+        obj = read_object(repo, sha)
+        if not isinstance(obj, G1tBlob):
+            raise Exception(f"Expected blob, got {obj.__class__.__name__}")
+        lines = obj.blobdata.decode("utf8").splitlines()
+        ignore.scoped[os.path.dirname(name)] = parse_git_ignore(lines)
 
     return ignore
 
 
+def gitignore_shas(index: G1tIndex) -> dict[str, str]:
+    # The .gitignore files in the index, by path.
+    return {
+        name: entry.sha
+        for name, entry in index.by_name.items()
+        if name == ".gitignore" or name.endswith("/.gitignore")
+    }
+
+
 def is_target_ignored(
     rules: list[ContentsAndIgnoreFlag], target_path: Path
 ) -> bool | None:
@@ -124,3 +139,13 @@ def check_ignore(rules: G1tIgnore, target_path: Path) -> bool:
     if check_ignore_scoped(rules.scoped, target_path):
         return True
     return check_ignore_not_scoped(rules.global_ignore, target_path)
+
+
+def check_ignore_dir(rules: G1tIgnore, target_path: Path) -> bool:
+    # Whether the files in a directory are all ignored, so that there is
+    # no need to look inside. Like git, a file can't be re-included once
+    # its directory is ignored.
+    if check_ignore_scoped(rules.scoped, target_path):
+        return True
+    # The global rules are matched against the directory of a file.
+    return check_ignore_not_scoped(rules.global_ignore, target_path / "_")
@@ -0,0 +1,107 @@
+from g1t.core.repository import Repository
+from g1t.core.pack import get_packs
+from bisect import bisect_left
+from pathlib import Path
+import os
+import threading
+
+# `git rev-parse --short` never goes below this many hex digits.
+DEFAULT_ABBREV = 7
+
+
+class G1tLooseIndex(object):
+    def __init__(self, objects_dir: Path) -> None:
+        self.objects_dir = objects_dir
+        # Sorted full SHAs per fanout directory ("ab" -> ["ab01...", ...]),
+        # each directory listed the first time it's needed.
+        self.fanout: dict[str, list[str]] = {}
+        # `add` may write objects from several threads at once.
+        self.lock = threading.Lock()
+
+    def names(self, fanout: str) -> list[str]:
+        names = self.fanout.get(fanout)
+        if names is None:
+            try:
+                entries = os.listdir(self.objects_dir / fanout)
+            except FileNotFoundError:
+                entries = []
+            # Skip temporary files left by interrupted writes.
+            names = sorted(fanout + e for e in entries if len(e) == 38)
+            with self.lock:
+                names = self.fanout.setdefault(fanout, names)
+        return names
+
+    def find_prefix(self, prefix: str) -> list[str]:
+        names = self.names(prefix[:2])
+        ret = []
+        i = bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            ret.append(names[i])
+            i += 1
+        return ret
+
+    def neighbours(self, sha: str) -> list[str]:
+        names = self.names(sha[:2])
+        i = bisect_left(names, sha)
+        return [n for n in names[max(i - 1, 0) : i + 2] if n != sha]
+
+    def contains(self, sha: str) -> bool:
+        names = self.names(sha[:2])
+        i = bisect_left(names, sha)
+        return i < len(names) and names[i] == sha
+
+    def add(self, sha: str) -> None:
+        # Unlisted directories will pick the new object up when listed.
+        with self.lock:
+            names = self.fanout.get(sha[:2])
+            if names is not None:
+                i = bisect_left(names, sha)
+                if i == len(names) or names[i] != sha:
+                    names.insert(i, sha)
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.fanout.clear()
+
+
+def get_loose_index(repo: Repository) -> G1tLooseIndex:
+    if repo.loose_index is None:
+        repo.loose_index = G1tLooseIndex(repo.gitdir / "objects")
+    return repo.loose_index
+
+
+def object_exists(repo: Repository, sha: str) -> bool:
+    raw_sha = bytes.fromhex(sha)
+    for pack in get_packs(repo):
+        if pack.index.find(raw_sha) is not None:
+            return True
+    return get_loose_index(repo).contains(sha)
+
+
+def find_objects_by_prefix(repo: Repository, prefix: str) -> list[str]:
+    # Every loose or packed object whose SHA starts with `prefix` (at least
+    # two hex digits, lower case). Both lookups are binary searches.
+    found = get_loose_index(repo).find_prefix(prefix)
+    for pack in get_packs(repo):
+        found.extend(pack.index.find_prefix(prefix))
+    return sorted(set(found))
+
+
+def abbreviate_object(
+    repo: Repository, sha: str, min_length: int = DEFAULT_ABBREV
+) -> str:
+    # The shortest prefix that no other object shares is one digit longer
+    # than the longest common prefix with the SHAs sorting right next to
+    # it, in the loose store and in each pack.
+    neighbours = get_loose_index(repo).neighbours(sha)
+    raw_sha = bytes.fromhex(sha)
+    for pack in get_packs(repo):
+        i = pack.index.lower_bound(raw_sha)
+        for j in range(max(i - 1, 0), min(i + 2, pack.index.count)):
+            neighbours.append(pack.index.sha_at(j).hex())
+
+    length = min_length
+    for other in neighbours:
+        if other != sha:
+            length = max(length, len(os.path.commonprefix([sha, other])) + 1)
+    return sha[: min(length, 40)]
@@ -1,14 +1,30 @@
 from g1t.core.repository import Repository
+from g1t.core.pack import (
+    STREAM_CHUNK_SIZE,
+    iter_inflate,
+    read_packed_object,
+    read_packed_object_info,
+    stream_packed_object,
+)
+from g1t.core.lookup import find_objects_by_prefix, get_loose_index, object_exists
+from g1t.core.cache import G1tLRUCache
+from g1t.core.config import config_get_int
 import zlib
 import hashlib
+import io
+import os
+import tempfile
 from collections import OrderedDict
 from pathlib import Path
 import re
 from dataclasses import dataclass
-from typing import Type
+from typing import BinaryIO, Callable, Iterator, Type
 
 Refs = OrderedDict[str, "Refs"]
 
+DEFAULT_OBJECT_CACHE_LIMIT = 64 * 1024 * 1024
+OBJECT_HEADER_READ_SIZE = 64
+
 
 @dataclass
 class G1tTreeLeaf(object):
@@ -58,6 +74,21 @@ class G1tCommit(object):
 class G1tTag(object):
     fmt = b"tag"
 
+    def __init__(self, data: bytes | None = None) -> None:
+        if data is not None:
+            self.deserialize(data)
+        else:
+            self.init()
+
+    def serialize(self) -> bytes:
+        return serialize_kvlm(self.kvlm)
+
+    def init(self) -> None:
+        self.kvlm = dict()
+
+    def deserialize(self, data: bytes) -> None:
+        self.kvlm = parse_kvlm(data)
+
 
 class G1tBlob(object):
     fmt = b"blob"
@@ -75,26 +106,149 @@ class G1tBlob(object):
 def read_object(
     repository: Repository, sha: str
 ) -> G1tTree | G1tTag | G1tBlob | G1tCommit:
+    fmt, data = read_raw_object(repository, sha)
+    return object_from_raw(fmt, data)
+
+
+def read_raw_object(repository: Repository, sha: str) -> tuple[str, bytes]:
+    # Objects are immutable, so the inflated bytes can be shared by every
+    # reader. We cache those rather than parsed objects, which callers are
+    # free to modify.
+    cache = get_object_cache(repository)
+    if cache is not None:
+        cached: tuple[str, bytes] | None = cache.get(sha)
+        if cached is not None:
+            return cached
+
+    fmt, data = read_stored_object(repository, sha)
+    if cache is not None:
+        cache.put(sha, (fmt, data), len(data))
+    return fmt, data
+
+
+def get_object_cache(repository: Repository) -> G1tLRUCache | None:
+    if repository.object_cache is None:
+        limit = config_get_int(
+            repository.config, "core", "objectcachelimit", DEFAULT_OBJECT_CACHE_LIMIT
+        )
+        # core.objectCacheLimit = 0 turns the cache off.
+        if limit <= 0:
+            return None
+        repository.object_cache = G1tLRUCache(limit)
+    return repository.object_cache
+
+
+def read_stored_object(repository: Repository, sha: str) -> tuple[str, bytes]:
+    packed = read_packed_object(repository, sha)
+    if packed is not None:
+        return packed
+
     path = repository.gitdir / "objects" / sha[:2] / sha[2:]
+    if not path.exists():
+        raise Exception(f"No such object {sha}")
     with path.open("rb") as f:
         raw = zlib.decompress(f.read())
-        space = raw.find(b" ")
-        fmt = raw[:space].decode("ascii")
-        null_byte = raw.find(b"\x00", space)
-        size = int(raw[space:null_byte].decode("ascii"))
-
-        if size != len(raw) - null_byte - 1:
-            raise Exception(f"Malformed object {sha}: bad length")
-        if fmt == "commit":
-            return G1tCommit(raw[null_byte + 1 :])
-        elif fmt == "tree":
-            return G1tTree(raw[null_byte + 1 :])
-        elif fmt == "tag":
-            return G1tTag(raw[null_byte + 1 :])
-        elif fmt == "blob":
-            return G1tBlob(raw[null_byte + 1 :])
-        else:
-            raise Exception(f"Unknown type {fmt}")
+    space = raw.find(b" ")
+    fmt = raw[:space].decode("ascii")
+    null_byte = raw.find(b"\x00", space)
+    size = int(raw[space:null_byte].decode("ascii"))
+
+    if size != len(raw) - null_byte - 1:
+        raise Exception(f"Malformed object {sha}: bad length")
+    return fmt, raw[null_byte + 1 :]
+
+
+def read_object_info(repository: Repository, sha: str) -> tuple[str, int]:
+    # Type and size of an object, inflating no more than its header.
+    cache = get_object_cache(repository)
+    cached = cache.get(sha) if cache is not None else None
+    if cached is not None:
+        return cached[0], len(cached[1])
+
+    packed = read_packed_object_info(repository, sha)
+    if packed is not None:
+        return packed
+
+    path = repository.gitdir / "objects" / sha[:2] / sha[2:]
+    if not path.exists():
+        raise Exception(f"No such object {sha}")
+    decompressor = zlib.decompressobj()
+    header = b""
+    with path.open("rb") as f:
+        # "<type> <size>\0" is at most a few dozen bytes.
+        while b"\x00" not in header:
+            chunk = decompressor.unconsumed_tail or f.read(OBJECT_HEADER_READ_SIZE)
+            if not chunk:
+                raise Exception(f"Malformed object {sha}: no header")
+            header += decompressor.decompress(chunk, OBJECT_HEADER_READ_SIZE)
+    space = header.find(b" ")
+    null_byte = header.find(b"\x00", space)
+    return header[:space].decode("ascii"), int(header[space:null_byte].decode("ascii"))
+
+
+def read_object_stream(
+    repository: Repository, sha: str
+) -> tuple[str, int, Iterator[bytes]]:
+    # Like read_raw_object, but hands the content out in chunks of at
+    # most STREAM_CHUNK_SIZE bytes, for blobs too big to hold in memory.
+    cache = get_object_cache(repository)
+    cached = cache.get(sha) if cache is not None else None
+    if cached is not None:
+        return cached[0], len(cached[1]), iter([cached[1]])
+
+    packed = stream_packed_object(repository, sha)
+    if packed is not None:
+        return packed
+
+    path = repository.gitdir / "objects" / sha[:2] / sha[2:]
+    if not path.exists():
+        raise Exception(f"No such object {sha}")
+    chunks = iter_inflate(iter_file(path))
+
+    # The header is tiny, so it always comes whole with the first chunk.
+    first = next(chunks)
+    space = first.find(b" ")
+    null_byte = first.find(b"\x00", space)
+    fmt = first[:space].decode("ascii")
+    size = int(first[space:null_byte].decode("ascii"))
+    body = first[null_byte + 1 :]
+    if len(body) == size and cache is not None:
+        # Small object: we already have all of it, keep it for next time.
+        cache.put(sha, (fmt, body), size)
+        return fmt, size, iter([body])
+    return fmt, size, check_stream_size(sha, size, body, chunks)
+
+
+def iter_file(path: Path) -> Iterator[bytes]:
+    with path.open("rb") as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def check_stream_size(
+    sha: str, size: int, first: bytes, chunks: Iterator[bytes]
+) -> Iterator[bytes]:
+    total = len(first)
+    if first:
+        yield first
+    for chunk in chunks:
+        total += len(chunk)
+        yield chunk
+    if total != size:
+        raise Exception(f"Malformed object {sha}: bad length")
+
+
+def object_from_raw(fmt: str, data: bytes) -> G1tTree | G1tTag | G1tBlob | G1tCommit:
+    if fmt == "commit":
+        return G1tCommit(data)
+    elif fmt == "tree":
+        return G1tTree(data)
+    elif fmt == "tag":
+        return G1tTag(data)
+    elif fmt == "blob":
+        return G1tBlob(data)
+    else:
+        raise Exception(f"Unknown type {fmt}")
 
 
 def write_object(
@@ -103,23 +257,86 @@ def write_object(
     data = obj.serialize()
     raw = obj.fmt + b" " + str(len(data)).encode() + b"\x00" + data
     sha = hashlib.sha1(raw).hexdigest()
+    # Checked against the in-memory object lists: no compression and no
+    # filesystem access for objects we already have.
+    if repository is not None and not object_exists(repository, sha):
+        path = repository.gitdir / "objects" / sha[:2] / sha[2:]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as f:
+            f.write(zlib.compress(raw))
+        get_loose_index(repository).add(sha)
+    return sha
+
+
+def write_object_stream(
+    stream: BinaryIO, fmt: bytes, size: int, repository: Repository | None = None
+) -> str:
+    # Hash (and compress, when writing) `size` bytes of `stream` chunk by
+    # chunk, so that memory use doesn't depend on the object size.
+    if repository is not None and stream.seekable():
+        # Hash in a first pass, so that re-adding an object we already have
+        # costs a read instead of a read plus compression.
+        start = stream.tell()
+        sha = write_object_stream(stream, fmt, size, None)
+        if object_exists(repository, sha):
+            return sha
+        stream.seek(start)
+
+    header = fmt + b" " + str(size).encode() + b"\x00"
+    hasher = hashlib.sha1(header)
+    if repository is None:
+        out = None
+    else:
+        objects_dir = repository.gitdir / "objects"
+        fd, tmp_name = tempfile.mkstemp(prefix="tmp_obj_", dir=objects_dir)
+        out = os.fdopen(fd, "wb")
+        compressor = zlib.compressobj()
+        out.write(compressor.compress(header))
+
+    total = 0
+    try:
+        while chunk := stream.read(STREAM_CHUNK_SIZE):
+            total += len(chunk)
+            hasher.update(chunk)
+            if out is not None:
+                out.write(compressor.compress(chunk))
+        if total != size:
+            raise Exception(f"File changed while hashing: expected {size} bytes")
+        if out is not None:
+            out.write(compressor.flush())
+            out.close()
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.unlink(tmp_name)
+        raise
+
+    sha = hasher.hexdigest()
     if repository is not None:
         path = repository.gitdir / "objects" / sha[:2] / sha[2:]
-        if not path.exists():
+        if path.exists():
+            os.unlink(tmp_name)
+        else:
             path.parent.mkdir(parents=True, exist_ok=True)
-            with path.open("wb") as f:
-                f.write(zlib.compress(raw))
+            os.replace(tmp_name, path)
+            get_loose_index(repository).add(sha)
     return sha
 
 
 def hash_object(file_data, fmt: str, repo=None):
-    data = file_data.read()
     match fmt:
         case "blob":
-            obj = G1tBlob(data)
+            pass
         case _:
             raise Exception(f"Unknown type {fmt}")
-    return write_object(obj, repo)
+    try:
+        size = os.fstat(file_data.fileno()).st_size
+    except (AttributeError, io.UnsupportedOperation):
+        # Not a real file: nothing to stream from.
+        return write_object(G1tBlob(file_data.read()), repo)
+    if size <= STREAM_CHUNK_SIZE:
+        return write_object(G1tBlob(file_data.read()), repo)
+    return write_object_stream(file_data, G1tBlob.fmt, size, repo)
 
 
 def find_object(
@@ -143,18 +360,24 @@ def find_object(
     sha = sha_list[0]
 
     while True:
-        obj = read_object(repo, sha)
+        if obj_type is None:
+            return sha
+
+        # Only the header is needed to tell whether we're done.
+        fmt, _ = read_object_info(repo, sha)
 
-        if isinstance(obj, obj_type):
+        if fmt == obj_type.fmt.decode("ascii"):
             return sha
 
         if not follow:
             return None
 
-        if isinstance(obj, G1tTag):
-            return obj.kvlm[b"object"].decode("ascii")
-        elif isinstance(obj, G1tCommit) and follow:
-            return obj.kvlm[b"tree"].decode("ascii")
+        if fmt == "tag":
+            _, data = read_raw_object(repo, sha)
+            sha = G1tTag(data).kvlm[b"object"].decode("ascii")
+        elif fmt == "commit":
+            _, data = read_raw_object(repo, sha)
+            sha = G1tCommit(data).kvlm[b"tree"].decode("ascii")
         else:
             return None
 
@@ -168,14 +391,9 @@ def resolve_object(repo: Repository, name: str) -> list[str]:
         return [resolve_ref(repo, "HEAD")]
     if hash_re.match(name):
         name = name.lower()
-        prefix = name[:2]
-        rem = name[2:]
-        dir = repo.gitdir / "objects" / prefix
-        for d in dir.iterdir():
-            if d.name.startswith(rem):
-                # user doesn't care about the full hash.
-                # so we need to check with `startswith`
-                candidates.append(prefix + d.name)
+        # user doesn't care about the full hash.
+        # so we look up every object starting with it.
+        candidates.extend(find_objects_by_prefix(repo, name))
     tag = resolve_ref(repo, "refs/tags/" + name)
     if tag:
         candidates.append(tag)
@@ -259,8 +477,10 @@ def tree_leaf_sort_key(leaf: G1tTreeLeaf) -> str:
 def serialize_tree(tree: G1tTree) -> bytes:
     ret = b""
     for leaf in sorted(tree.items, key=tree_leaf_sort_key):
+        # Modes are kept zero-padded in memory, but git stores trees as
+        # "40000"; anything else gives a different tree SHA.
         ret += (
-            leaf.mode
+            leaf.mode.lstrip(b"0")
             + b" "
             + leaf.path.encode("utf8")
             + b"\x00"
@@ -269,22 +489,42 @@ def serialize_tree(tree: G1tTree) -> bytes:
     return ret
 
 
-def checkout_tree(repo: Repository, tree: G1tTree, path: Path) -> None:
+def checkout_tree(
+    repo: Repository,
+    tree: G1tTree,
+    path: Path,
+    include: Callable[[str], bool] | None = None,
+    prefix: str = "",
+) -> None:
+    # include filters the paths relative to the tree, directories with a
+    # trailing "/"; excluded directories are not even read.
     for item in tree.items:
-        obj = read_object(repo, item.sha)
         dst = path / item.path
-        if isinstance(obj, G1tTree):
+        if item.mode.startswith(b"04"):
+            if include is not None and not include(prefix + item.path + "/"):
+                continue
+            subtree = read_object(repo, item.sha)
+            if not isinstance(subtree, G1tTree):
+                raise Exception(f"fatal: object {item.sha} is not a tree")
             dst.mkdir(exist_ok=True)
-            checkout_tree(repo, obj, dst)
-        else:
-            with dst.open("wb") as f:
-                f.write(obj.blobdata)
+            checkout_tree(repo, subtree, dst, include, prefix + item.path + "/")
+        elif include is None or include(prefix + item.path):
+            checkout_blob(repo, item.sha, dst)
+
+
+def checkout_blob(repo: Repository, sha: str, path: Path) -> None:
+    fmt, _, chunks = read_object_stream(repo, sha)
+    if fmt != "blob":
+        raise Exception(f"Expected blob, got {fmt}")
+    with path.open("wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
 
 
 def resolve_ref(repo: Repository, refname: str) -> str:
     refpath = repo.gitdir / refname
     if not refpath.exists():
-        return None
+        return resolve_packed_ref(repo, refname)
     with refpath.open() as f:
         refname = f.read()[:-1]
     if refname.startswith("ref: "):
@@ -292,6 +532,22 @@ def resolve_ref(repo: Repository, refname: str) -> str:
     return refname
 
 
+def resolve_packed_ref(repo: Repository, refname: str) -> str | None:
+    # `git gc` moves loose refs into packed-refs: "<sha> <refname>" lines,
+    # with "#" headers and "^<sha>" peeled tag lines we don't need.
+    packed_refs = repo.gitdir / "packed-refs"
+    if not packed_refs.exists():
+        return None
+    with packed_refs.open() as f:
+        for line in f:
+            if line.startswith("#") or line.startswith("^"):
+                continue
+            sha, _, name = line.rstrip("\n").partition(" ")
+            if name == refname:
+                return sha
+    return None
+
+
 def list_ref(repo: Repository, path: Path | None = None) -> Refs:
     if not path:
         path = repo.gitdir / "refs"
@@ -0,0 +1,619 @@
+from g1t.core.repository import Repository
+from g1t.core.cache import G1tLRUCache
+from g1t.core.config import config_get_fsync, config_get_int
+from g1t.core.varint import decode_varint, encode_varint
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+IDX_MAGIC = b"\377tOc"
+PACK_MAGIC = b"PACK"
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+PACK_TYPE_NAMES = {
+    OBJ_COMMIT: "commit",
+    OBJ_TREE: "tree",
+    OBJ_BLOB: "blob",
+    OBJ_TAG: "tag",
+}
+PACK_TYPE_NUMBERS = {name: num for num, name in PACK_TYPE_NAMES.items()}
+
+# Compressed entries are fed to zlib in slices of the mapped pack, so we
+# never copy more than this many bytes of the pack at once.
+INFLATE_CHUNK_SIZE = 64 * 1024
+# Compressed bytes fed to zlib at a time to get the sizes of a delta.
+DELTA_HEADER_READ_SIZE = 64
+# Upper bound on the size of each piece handed out when streaming objects.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# create_delta indexes the base in blocks of this many bytes.
+DELTA_BLOCK_SIZE = 16
+# A single copy instruction can carry at most 3 bytes of size.
+DELTA_MAX_COPY = 0xFFFFFF
+
+# Same default as git's core.deltaBaseCacheLimit.
+DEFAULT_DELTA_BASE_CACHE_LIMIT = 96 * 1024 * 1024
+
+
+class G1tPackIndex(object):
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:4] != IDX_MAGIC:
+            raise Exception(f"Unsupported pack index (v1?) {path}")
+        version = int.from_bytes(self.data[4:8], "big")
+        if version != 2:
+            raise Exception(f"Unsupported pack index version {version}")
+
+        # 256 cumulative counts: fanout[b] is the number of objects whose
+        # first byte is <= b.
+        self.fanout = struct.unpack_from(">256I", self.data, 8)
+        self.count = self.fanout[255]
+        self.sha_table = 8 + 256 * 4
+        self.crc_table = self.sha_table + 20 * self.count
+        self.offset_table = self.crc_table + 4 * self.count
+        self.large_offset_table = self.offset_table + 4 * self.count
+
+    def sha_at(self, i: int) -> bytes:
+        pos = self.sha_table + 20 * i
+        return self.data[pos : pos + 20]
+
+    def offset_at(self, i: int) -> int:
+        pos = self.offset_table + 4 * i
+        offset = int.from_bytes(self.data[pos : pos + 4], "big")
+        if offset & 0x80000000:
+            # MSB set: the rest is an index into the 8-byte offset table.
+            pos = self.large_offset_table + 8 * (offset & 0x7FFFFFFF)
+            offset = int.from_bytes(self.data[pos : pos + 8], "big")
+        return offset
+
+    def lower_bound(self, sha: bytes) -> int:
+        lo = self.fanout[sha[0] - 1] if sha[0] > 0 else 0
+        hi = self.fanout[sha[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sha_at(mid) < sha:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, sha: bytes) -> int | None:
+        i = self.lower_bound(sha)
+        if i < self.count and self.sha_at(i) == sha:
+            return self.offset_at(i)
+        return None
+
+    def find_prefix(self, prefix: str) -> list[str]:
+        # Pad the hex prefix with zeros to get the smallest candidate, then
+        # scan forward while the names still share the prefix.
+        start = bytes.fromhex(prefix.ljust(40, "0"))
+        ret = []
+        i = self.lower_bound(start)
+        while i < self.count:
+            sha = self.sha_at(i).hex()
+            if not sha.startswith(prefix):
+                break
+            ret.append(sha)
+            i += 1
+        return ret
+
+
+class G1tPack(object):
+    def __init__(self, index_path: Path, repo: Repository) -> None:
+        self.index = G1tPackIndex(index_path)
+        self.path = index_path.with_suffix(".pack")
+        # Needed to find REF_DELTA bases that live in another pack.
+        self.repo = repo
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:4] != PACK_MAGIC:
+            raise Exception(f"Invalid pack file signature {self.path}")
+        version = int.from_bytes(self.data[4:8], "big")
+        if version not in (2, 3):
+            raise Exception(f"Unsupported pack version {version}")
+
+    def read_entry_header(self, offset: int) -> tuple[int, int, int]:
+        # Type and size share a little-endian varint: 1 continuation bit,
+        # 3 bits of type and 4 bits of size in the first byte, then 7 bits
+        # of size per byte.
+        c = self.data[offset]
+        obj_type = (c >> 4) & 0b111
+        size = c & 0b1111
+        shift = 4
+        while c & 0x80:
+            offset += 1
+            c = self.data[offset]
+            size |= (c & 0x7F) << shift
+            shift += 7
+        return obj_type, size, offset + 1
+
+    def read_ofs_delta_base(self, offset: int, data_offset: int) -> tuple[int, int]:
+        # The base is this many bytes before the delta entry.
+        distance, data_offset = decode_varint(self.data, data_offset)
+        return offset - distance, data_offset
+
+    def inflate(self, offset: int, size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        view = memoryview(self.data)
+        chunks = []
+        # Most entries are small, so try to get away with a single slice.
+        chunk_size = min(size + 64, INFLATE_CHUNK_SIZE)
+        while not decompressor.eof:
+            chunk = view[offset : offset + chunk_size]
+            if len(chunk) == 0:
+                raise Exception(f"Truncated pack entry in {self.path}")
+            chunks.append(decompressor.decompress(chunk))
+            offset += len(chunk)
+            chunk_size = INFLATE_CHUNK_SIZE
+        data = b"".join(chunks)
+        if len(data) != size:
+            raise Exception(f"Malformed pack entry in {self.path}: bad length")
+        return data
+
+    def iter_compressed(self, offset: int) -> Iterator[memoryview]:
+        view = memoryview(self.data)
+        while offset < len(self.data):
+            yield view[offset : offset + INFLATE_CHUNK_SIZE]
+            offset += INFLATE_CHUNK_SIZE
+
+    def stream(self, offset: int) -> tuple[str, int, Iterator[bytes]]:
+        obj_type, size, data_offset = self.read_entry_header(offset)
+        if obj_type in PACK_TYPE_NAMES:
+            chunks = iter_inflate(self.iter_compressed(data_offset))
+            return PACK_TYPE_NAMES[obj_type], size, chunks
+        # A delta needs its whole base in memory anyway.
+        fmt, data = self.read(offset)
+        return fmt, len(data), iter([data])
+
+    def info(self, offset: int) -> tuple[str, int]:
+        # Type and size without inflating the object. For a delta, the
+        # size is in the first bytes of the delta data and the type is the
+        # one of the object at the bottom of the chain.
+        obj_type, size, data_offset = self.read_entry_header(offset)
+        if obj_type in PACK_TYPE_NAMES:
+            return PACK_TYPE_NAMES[obj_type], size
+
+        if obj_type == OBJ_OFS_DELTA:
+            _, data_offset = self.read_ofs_delta_base(offset, data_offset)
+        else:
+            data_offset += 20
+        # Two varints, which end with the first two bytes without the
+        # continuation bit. A compressed block can start with a Huffman
+        # table long enough to give no output for the first input bytes, so
+        # feed zlib until both are out.
+        view = memoryview(self.data)
+        decompressor = zlib.decompressobj()
+        delta_header = b""
+        while sum(1 for c in delta_header if not c & 0x80) < 2:
+            chunk: bytes | memoryview = decompressor.unconsumed_tail
+            if not chunk:
+                chunk = view[data_offset : data_offset + DELTA_HEADER_READ_SIZE]
+                data_offset += len(chunk)
+            if not chunk or decompressor.eof:
+                raise Exception(f"Truncated delta in {self.path}")
+            delta_header += decompressor.decompress(chunk, DELTA_HEADER_READ_SIZE)
+        _, pos = read_delta_size(delta_header, 0)
+        result_size, _ = read_delta_size(delta_header, pos)
+        return self.info_type(offset), result_size
+
+    def info_type(self, offset: int) -> str:
+        while True:
+            obj_type, _, data_offset = self.read_entry_header(offset)
+            if obj_type in PACK_TYPE_NAMES:
+                return PACK_TYPE_NAMES[obj_type]
+            if obj_type == OBJ_OFS_DELTA:
+                offset, _ = self.read_ofs_delta_base(offset, data_offset)
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = self.data[data_offset : data_offset + 20]
+                base_offset = self.index.find(base_sha)
+                if base_offset is None:
+                    base = read_packed_object_info(self.repo, base_sha.hex())
+                    if base is None:
+                        raise Exception(f"Missing delta base {base_sha.hex()}")
+                    return base[0]
+                offset = base_offset
+            else:
+                raise Exception(f"Unsupported pack entry type {obj_type}")
+
+    def read(self, offset: int) -> tuple[str, bytes]:
+        cache = get_delta_base_cache(self.repo)
+
+        # Walk down the delta chain until we reach a full object, either
+        # stored in the pack or already reconstructed in the cache.
+        chain: list[tuple[int, int, int]] = []
+        while True:
+            cached = cache.get((self.path, offset))
+            if cached is not None:
+                fmt, data = cached
+                break
+
+            obj_type, size, data_offset = self.read_entry_header(offset)
+            if obj_type == OBJ_OFS_DELTA:
+                base_offset, data_offset = self.read_ofs_delta_base(offset, data_offset)
+                chain.append((offset, data_offset, size))
+                offset = base_offset
+            elif obj_type == OBJ_REF_DELTA:
+                base_sha = self.data[data_offset : data_offset + 20]
+                chain.append((offset, data_offset + 20, size))
+                found = self.index.find(base_sha)
+                if found is None:
+                    base = read_packed_object(self.repo, base_sha.hex())
+                    if base is None:
+                        raise Exception(f"Missing delta base {base_sha.hex()}")
+                    fmt, data = base
+                    break
+                offset = found
+            elif obj_type in PACK_TYPE_NAMES:
+                fmt = PACK_TYPE_NAMES[obj_type]
+                data = self.inflate(data_offset, size)
+                if chain:
+                    cache.put((self.path, offset), (fmt, data), len(data))
+                break
+            else:
+                raise Exception(f"Unsupported pack entry type {obj_type}")
+
+        # Every object rebuilt along the way except the one we were asked
+        # for is a delta base, and likely to be shared with its siblings.
+        for i in range(len(chain) - 1, -1, -1):
+            delta_offset, data_offset, size = chain[i]
+            data = apply_delta(data, self.inflate(data_offset, size))
+            if i > 0:
+                cache.put((self.path, delta_offset), (fmt, data), len(data))
+        return fmt, data
+
+
+def iter_inflate(compressed: Iterator[bytes | memoryview]) -> Iterator[bytes]:
+    # Inflate a zlib stream piece by piece. Output is capped per call, so
+    # memory stays bounded no matter how well the data compresses.
+    decompressor = zlib.decompressobj()
+    for chunk in compressed:
+        while chunk and not decompressor.eof:
+            data = decompressor.decompress(chunk, STREAM_CHUNK_SIZE)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+        # Drain whatever zlib held back because of the output cap.
+        while not decompressor.eof:
+            data = decompressor.decompress(b"", STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+        if decompressor.eof:
+            return
+    raise Exception("Truncated zlib stream")
+
+
+def read_delta_size(delta: bytes, pos: int) -> tuple[int, int]:
+    size = 0
+    shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_size, pos = read_delta_size(delta, 0)
+    if base_size != len(base):
+        raise Exception("Delta base size mismatch")
+    result_size, pos = read_delta_size(delta, pos)
+
+    base_view = memoryview(base)
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy from the base. The low 7 bits say which offset (4) and
+            # size (3) bytes follow; missing bytes are zero.
+            copy_offset = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_offset |= delta[pos] << (8 * i)
+                    pos += 1
+            copy_size = 0
+            for i in range(3):
+                if op & (0x10 << i):
+                    copy_size |= delta[pos] << (8 * i)
+                    pos += 1
+            if copy_size == 0:
+                copy_size = 0x10000
+            result += base_view[copy_offset : copy_offset + copy_size]
+        elif op:
+            # Insert the next `op` bytes of the delta as-is.
+            result += delta[pos : pos + op]
+            pos += op
+        else:
+            raise Exception("Invalid delta opcode 0")
+
+    if len(result) != result_size:
+        raise Exception("Delta result size mismatch")
+    return bytes(result)
+
+
+def encode_delta_size(size: int) -> bytes:
+    ret = bytearray()
+    while True:
+        c = size & 0x7F
+        size >>= 7
+        if size:
+            ret.append(c | 0x80)
+        else:
+            ret.append(c)
+            return bytes(ret)
+
+
+def create_delta(
+    base: bytes, target: bytes, max_size: int | None = None
+) -> bytes | None:
+    # Index every aligned block of the base, then scan the target for
+    # blocks we've seen: matches become copy instructions (extended as far
+    # as the bytes keep agreeing), everything else is inserted literally.
+    # Returns None as soon as the delta grows past `max_size`.
+    index: dict[bytes, int] = {}
+    for i in range(0, len(base) - DELTA_BLOCK_SIZE + 1, DELTA_BLOCK_SIZE):
+        index.setdefault(base[i : i + DELTA_BLOCK_SIZE], i)
+
+    delta = bytearray(encode_delta_size(len(base)) + encode_delta_size(len(target)))
+    insert_start = 0
+    i = 0
+    while i < len(target):
+        copy_offset = index.get(target[i : i + DELTA_BLOCK_SIZE])
+        if copy_offset is None:
+            i += 1
+            continue
+
+        # Grow the match forwards, 64 bytes at a time while we can.
+        length = DELTA_BLOCK_SIZE
+        limit = min(len(target) - i, len(base) - copy_offset, DELTA_MAX_COPY)
+        while (
+            length + 64 <= limit
+            and target[i + length : i + length + 64]
+            == base[copy_offset + length : copy_offset + length + 64]
+        ):
+            length += 64
+        while length < limit and target[i + length] == base[copy_offset + length]:
+            length += 1
+        # ...and backwards into the bytes we were about to insert.
+        while (
+            i > insert_start
+            and copy_offset > 0
+            and length < DELTA_MAX_COPY
+            and target[i - 1] == base[copy_offset - 1]
+        ):
+            i -= 1
+            copy_offset -= 1
+            length += 1
+
+        append_delta_insert(delta, target, insert_start, i)
+        append_delta_copy(delta, copy_offset, length)
+        i += length
+        insert_start = i
+        if max_size is not None and len(delta) > max_size:
+            return None
+
+    append_delta_insert(delta, target, insert_start, len(target))
+    if max_size is not None and len(delta) > max_size:
+        return None
+    return bytes(delta)
+
+
+def append_delta_insert(delta: bytearray, target: bytes, start: int, end: int) -> None:
+    # Insert instructions carry at most 127 literal bytes each.
+    while start < end:
+        n = min(end - start, 0x7F)
+        delta.append(n)
+        delta += target[start : start + n]
+        start += n
+
+
+def append_delta_copy(delta: bytearray, offset: int, size: int) -> None:
+    op = 0x80
+    args = bytearray()
+    for i in range(4):
+        byte = (offset >> (8 * i)) & 0xFF
+        if byte:
+            op |= 1 << i
+            args.append(byte)
+    for i in range(3):
+        byte = (size >> (8 * i)) & 0xFF
+        if byte:
+            op |= 0x10 << i
+            args.append(byte)
+    delta.append(op)
+    delta += args
+
+
+@dataclass
+class G1tPackEntry(object):
+    sha: str
+    fmt: str
+    data: bytes
+    # Set when `data` is a delta against the entry at this position.
+    delta_base: int | None = None
+
+
+def encode_entry_header(obj_type: int, size: int) -> bytes:
+    ret = bytearray()
+    c = (obj_type << 4) | (size & 0b1111)
+    size >>= 4
+    while size:
+        ret.append(c | 0x80)
+        c = size & 0x7F
+        size >>= 7
+    ret.append(c)
+    return bytes(ret)
+
+
+def write_pack(repo: Repository, entries: Iterable[G1tPackEntry], count: int) -> str:
+    # Deltas are written as OFS_DELTA, so every base must come before the
+    # entries that refer to it. Entries can be generated as they are
+    # written; only their SHAs, CRCs and offsets are kept for the index.
+    pack_dir = repo.gitdir / "objects" / "pack"
+    pack_dir.mkdir(parents=True, exist_ok=True)
+
+    shas: list[bytes] = []
+    offsets: list[int] = []
+    crcs: list[int] = []
+    hasher = hashlib.sha1()
+    fd, tmp_name = tempfile.mkstemp(prefix="tmp_pack_", dir=pack_dir)
+    with os.fdopen(fd, "wb") as f:
+        header = PACK_MAGIC + (2).to_bytes(4, "big") + count.to_bytes(4, "big")
+        f.write(header)
+        hasher.update(header)
+        offset = len(header)
+        for entry in entries:
+            if entry.delta_base is None:
+                raw = encode_entry_header(PACK_TYPE_NUMBERS[entry.fmt], len(entry.data))
+            else:
+                if entry.delta_base >= len(offsets):
+                    raise Exception(f"Delta base of {entry.sha} is written after it")
+                distance = offset - offsets[entry.delta_base]
+                raw = encode_entry_header(OBJ_OFS_DELTA, len(entry.data))
+                raw += encode_varint(distance)
+            raw += zlib.compress(entry.data)
+            f.write(raw)
+            hasher.update(raw)
+            shas.append(bytes.fromhex(entry.sha))
+            offsets.append(offset)
+            crcs.append(zlib.crc32(raw))
+            offset += len(raw)
+        if len(shas) != count:
+            raise Exception(f"Expected {count} pack entries, got {len(shas)}")
+        pack_checksum = hasher.digest()
+        f.write(pack_checksum)
+        if config_get_fsync(repo.config, "pack"):
+            f.flush()
+            os.fsync(f.fileno())
+
+    # get_packs finds packs by their .idx, so like git the .pack goes in
+    # place first, and the .idx last.
+    pack_name = "pack-" + pack_checksum.hex()
+    os.replace(tmp_name, pack_dir / (pack_name + ".pack"))
+    write_pack_index(
+        pack_dir / (pack_name + ".idx"),
+        list(zip(shas, crcs, offsets)),
+        pack_checksum,
+        config_get_fsync(repo.config, "pack")
+        or config_get_fsync(repo.config, "pack-metadata"),
+    )
+    return pack_checksum.hex()
+
+
+def write_pack_index(
+    path: Path,
+    objects: list[tuple[bytes, int, int]],
+    pack_checksum: bytes,
+    fsync: bool = False,
+) -> None:
+    objects = sorted(objects)
+    fanout = [0] * 256
+    for sha, _, _ in objects:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+
+    large_offsets: list[int] = []
+    offsets = []
+    for _, _, offset in objects:
+        if offset < 0x80000000:
+            offsets.append(offset)
+        else:
+            offsets.append(0x80000000 | len(large_offsets))
+            large_offsets.append(offset)
+
+    raw = bytearray(IDX_MAGIC + (2).to_bytes(4, "big"))
+    raw += struct.pack(">256I", *fanout)
+    for sha, _, _ in objects:
+        raw += sha
+    raw += struct.pack(f">{len(objects)}I", *(crc for _, crc, _ in objects))
+    raw += struct.pack(f">{len(offsets)}I", *offsets)
+    raw += struct.pack(f">{len(large_offsets)}Q", *large_offsets)
+    raw += pack_checksum
+    raw += hashlib.sha1(raw).digest()
+
+    tmp_path = path.with_suffix(".idx.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def get_delta_base_cache(repo: Repository) -> G1tLRUCache:
+    if repo.delta_base_cache is None:
+        limit = config_get_int(
+            repo.config,
+            "core",
+            "deltabasecachelimit",
+            DEFAULT_DELTA_BASE_CACHE_LIMIT,
+        )
+        repo.delta_base_cache = G1tLRUCache(limit)
+    return repo.delta_base_cache
+
+
+def get_packs(repo: Repository) -> list[G1tPack]:
+    if repo.packs is None:
+        pack_dir = repo.gitdir / "objects" / "pack"
+        if pack_dir.is_dir():
+            repo.packs = [G1tPack(p, repo) for p in sorted(pack_dir.glob("*.idx"))]
+        else:
+            repo.packs = []
+    return repo.packs
+
+
+def find_packed_object(repo: Repository, sha: str) -> tuple[G1tPack, int] | None:
+    if len(sha) != 40:
+        return None
+    raw_sha = bytes.fromhex(sha)
+    for pack in get_packs(repo):
+        offset = pack.index.find(raw_sha)
+        if offset is not None:
+            return pack, offset
+    return None
+
+
+def read_packed_object(repo: Repository, sha: str) -> tuple[str, bytes] | None:
+    found = find_packed_object(repo, sha)
+    if found is None:
+        return None
+    pack, offset = found
+    return pack.read(offset)
+
+
+def read_packed_object_info(repo: Repository, sha: str) -> tuple[str, int] | None:
+    found = find_packed_object(repo, sha)
+    if found is None:
+        return None
+    pack, offset = found
+    return pack.info(offset)
+
+
+def stream_packed_object(
+    repo: Repository, sha: str
+) -> tuple[str, int, Iterator[bytes]] | None:
+    found = find_packed_object(repo, sha)
+    if found is None:
+        return None
+    pack, offset = found
+    return pack.stream(offset)
@@ -0,0 +1,247 @@
+from g1t.core.repository import Repository
+from g1t.core.object import (
+    read_object_info,
+    read_raw_object,
+    resolve_ref,
+    G1tCommit,
+    G1tTag,
+    G1tTree,
+)
+from g1t.core.pack import G1tPackEntry, create_delta, write_pack, get_packs
+from g1t.core.lookup import get_loose_index, object_exists
+from g1t.core.index import read_index
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+import re
+import time
+
+# Objects smaller than this aren't worth the delta header overhead.
+MIN_DELTA_SIZE = 64
+
+SHA_RE = re.compile("[0-9a-f]{40}")
+
+PACK_ORDER = {"commit": 0, "tag": 1, "tree": 2, "blob": 3}
+
+
+@dataclass
+class G1tRepackStats(object):
+    objects: int
+    deltas: int
+    seconds: float
+    pack: str
+
+
+def list_ref_shas(repo: Repository) -> list[str]:
+    # Symbolic refs, like refs/remotes/origin/HEAD in a clone, are followed
+    # through loose refs and packed-refs. A dangling one resolves to
+    # nothing, and is skipped with anything else that isn't a SHA.
+    names = ["HEAD"]
+    refs_dir = repo.gitdir / "refs"
+    for root, _, files in refs_dir.walk():
+        names.extend(
+            (root / name).relative_to(repo.gitdir).as_posix() for name in files
+        )
+    shas = [resolve_ref(repo, name) for name in names]
+
+    packed_refs = repo.gitdir / "packed-refs"
+    if packed_refs.exists():
+        for line in packed_refs.read_text().splitlines():
+            if line.startswith("#"):
+                continue
+            # "^<sha>" lines are peeled tags; the tag object is enough.
+            if not line.startswith("^"):
+                shas.append(line.split(" ")[0])
+    return [sha for sha in shas if sha is not None and SHA_RE.fullmatch(sha)]
+
+
+def list_index_shas(repo: Repository) -> list[tuple[str, str]]:
+    # Like git pack-objects --indexed-objects: staged blobs, sparse
+    # directories and the trees of the cache-tree are kept, even when no
+    # commit refers to them yet. With the file name, as for tree leaves.
+    index = read_index(repo)
+    roots = []
+    for name, entry in index.by_name.items():
+        # Submodules point to commits in another repository.
+        if entry.mode_type != 0b1110:
+            roots.append((entry.sha, name.rstrip("/").rsplit("/", 1)[-1]))
+    nodes = [index.cache_tree] if index.cache_tree is not None else []
+    while nodes:
+        node = nodes.pop()
+        if node.sha is not None:
+            roots.append((node.sha, ""))
+        nodes.extend(node.subtrees.values())
+    # A stale cache-tree may name trees that were never written.
+    return [(sha, path) for sha, path in roots if object_exists(repo, sha)]
+
+
+def list_reachable_objects(repo: Repository) -> list[tuple[str, str, str, int]]:
+    # (sha, type, path, size) for everything reachable from refs and the
+    # index. Paths are remembered so that blobs of the same file end up
+    # next to each other when looking for delta bases. Only commits, tags
+    # and trees are inflated here, to find what they point to; the data
+    # of an object is read again when it is needed, so that the whole
+    # repository is never in memory at once.
+    ret = []
+    seen: set[str] = set()
+    stack = [(sha, "") for sha in list_ref_shas(repo)]
+    stack.extend(list_index_shas(repo))
+    while stack:
+        sha, path = stack.pop()
+        if sha in seen:
+            continue
+        seen.add(sha)
+        fmt, size = read_object_info(repo, sha)
+        ret.append((sha, fmt, path, size))
+        if fmt == "blob":
+            continue
+
+        _, data = read_raw_object(repo, sha)
+        if fmt == "commit":
+            commit = G1tCommit(data)
+            stack.append((commit.kvlm[b"tree"].decode("ascii"), ""))
+            parents = commit.kvlm.get(b"parent", [])
+            if not isinstance(parents, list):
+                parents = [parents]
+            stack.extend((parent.decode("ascii"), "") for parent in parents)
+        elif fmt == "tag":
+            stack.append((G1tTag(data).kvlm[b"object"].decode("ascii"), ""))
+        elif fmt == "tree":
+            for leaf in G1tTree(data).items:
+                # Submodules point to commits in another repository.
+                if leaf.mode != b"160000":
+                    stack.append((leaf.sha, leaf.path))
+    return ret
+
+
+def name_hash(path: str) -> int:
+    # git's pack_name_hash: the last characters weigh the most, so files
+    # with the same name or extension sort together.
+    ret = 0
+    for c in path.encode("utf8"):
+        if chr(c).isspace():
+            continue
+        ret = (ret >> 2) + (c << 24)
+    return ret & 0xFFFFFFFF
+
+
+def find_deltas(
+    repo: Repository,
+    objects: list[tuple[str, str, str, int]],
+    window: int,
+    depth: int,
+) -> list[tuple[int, bytes] | None]:
+    # For each object, try the previous `window` objects of the same type
+    # as a base and keep the smallest delta, if any. Bases always come
+    # earlier in the list, and only the objects in the window are held in
+    # memory.
+    ret: list[tuple[int, bytes] | None] = []
+    depths = [0] * len(objects)
+    recent: deque[tuple[int, str, bytes]] = deque(maxlen=window)
+    for i, (sha, fmt, _, size) in enumerate(objects):
+        _, data = read_raw_object(repo, sha)
+        best: tuple[int, bytes] | None = None
+        if size >= MIN_DELTA_SIZE:
+            for j, base_fmt, base in reversed(recent):
+                if base_fmt != fmt or depths[j] >= depth:
+                    continue
+                if len(base) < MIN_DELTA_SIZE or len(base) > 2 * size + 1024:
+                    continue
+                max_size = size // 2 if best is None else len(best[1]) - 1
+                delta = create_delta(base, data, max_size)
+                if delta is not None:
+                    best = (j, delta)
+        if best is not None:
+            depths[i] = depths[best[0]] + 1
+        ret.append(best)
+        recent.append((i, fmt, data))
+    return ret
+
+
+def find_deltas_in_chunk(
+    args: tuple[Path, list[tuple[str, str, str, int]], int, int],
+) -> list[tuple[int, bytes] | None]:
+    # Workers open the repository themselves rather than being sent the
+    # objects' data.
+    worktree, chunk, window, depth = args
+    return find_deltas(Repository(worktree), chunk, window, depth)
+
+
+def pack_entries(
+    repo: Repository,
+    objects: list[tuple[str, str, str, int]],
+    deltas: list[tuple[int, bytes] | None],
+) -> Iterator[G1tPackEntry]:
+    for (sha, fmt, _, _), found in zip(objects, deltas):
+        if found is None:
+            _, data = read_raw_object(repo, sha)
+            yield G1tPackEntry(sha=sha, fmt=fmt, data=data)
+        else:
+            yield G1tPackEntry(sha=sha, fmt=fmt, data=found[1], delta_base=found[0])
+
+
+def repack(
+    repo: Repository, window: int = 10, depth: int = 50, workers: int = 1
+) -> G1tRepackStats:
+    start = time.monotonic()
+    objects = list_reachable_objects(repo)
+    objects.sort(key=lambda o: (PACK_ORDER[o[1]], name_hash(o[2]), -o[3], o[0]))
+
+    # Split the sorted list into contiguous chunks, one per worker. Only
+    # the first objects of each chunk lose part of their window.
+    deltas: list[tuple[int, bytes] | None] = []
+    if workers > 1 and len(objects) > workers * window:
+        chunk_size = -(-len(objects) // workers)
+        starts = range(0, len(objects), chunk_size)
+        chunks = [objects[i : i + chunk_size] for i in starts]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                find_deltas_in_chunk,
+                [(repo.worktree, chunk, window, depth) for chunk in chunks],
+            )
+            for chunk_start, result in zip(starts, results):
+                for found in result:
+                    if found is not None:
+                        found = (chunk_start + found[0], found[1])
+                    deltas.append(found)
+    else:
+        deltas = find_deltas(repo, objects, window, depth)
+
+    old_packs = get_packs(repo)
+    pack_sha = write_pack(repo, pack_entries(repo, objects, deltas), len(objects))
+
+    # Like `git repack -a -d`: the new pack holds every reachable object
+    # and everything the index uses, so older packs and the loose copies
+    # of packed objects can go.
+    new_pack = f"pack-{pack_sha}.pack"
+    for pack in old_packs:
+        if pack.path.name != new_pack:
+            for path in pack.path.parent.glob(pack.path.stem + ".*"):
+                path.unlink()
+    repo.packs = None
+    prune_loose_objects(repo, {sha for sha, _, _, _ in objects})
+    get_loose_index(repo).invalidate()
+
+    return G1tRepackStats(
+        objects=len(objects),
+        deltas=sum(1 for d in deltas if d is not None),
+        seconds=time.monotonic() - start,
+        pack=pack_sha,
+    )
+
+
+def prune_loose_objects(repo: Repository, packed: set[str]) -> int:
+    count = 0
+    objects_dir = repo.gitdir / "objects"
+    for fanout in objects_dir.iterdir():
+        if len(fanout.name) != 2 or not fanout.is_dir():
+            continue
+        for path in fanout.iterdir():
+            if fanout.name + path.name in packed:
+                path.unlink()
+                count += 1
+        if not any(fanout.iterdir()):
+            fanout.rmdir()
+    return count
@@ -1,11 +1,25 @@
 from pathlib import Path
 from configparser import ConfigParser
+from g1t.core.cache import G1tLRUCache
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # Both modules import this one.
+    from g1t.core.lookup import G1tLooseIndex
+    from g1t.core.pack import G1tPack
 
 
 class Repository:
     def __init__(self, path: Path, check_dir_exist: bool = False) -> None:
         self.worktree = path
         self.gitdir = path / ".git"
+        # Opened lazily by g1t.core.pack.get_packs
+        self.packs: "list[G1tPack] | None" = None
+        self.delta_base_cache: G1tLRUCache | None = None
+        # Inflated objects by SHA; see g1t.core.object.get_object_cache
+        self.object_cache: G1tLRUCache | None = None
+        # Sorted loose object names; see g1t.core.lookup.get_loose_index
+        self.loose_index: "G1tLooseIndex | None" = None
 
         if check_dir_exist and not self.gitdir.is_dir():
             raise Exception(f"Not a git repository {path}")
@@ -16,3 +30,4 @@ class Repository:
             config_parser.read(config_file)
             if check_dir_exist:
                 raise Exception(f"Config file missing {config_file}")
+        self.config = config_parser
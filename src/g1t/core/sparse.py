@@ -0,0 +1,265 @@
+from g1t.core.repository import Repository
+from g1t.core.config import config_get_bool
+from g1t.core.cache_tree import G1tCacheTree
+from g1t.core.commit import tree_from_index
+from g1t.core.index import G1tIndex, G1tIndexEntry, index_entry_from_stat
+from g1t.core.object import checkout_blob, hash_object
+from g1t.core.utils import tree_to_dict
+from pathlib import Path
+from typing import Iterable
+import bisect
+import dataclasses
+import os
+
+# Sparse directory entries have a tree's mode and SHA, and a name ending
+# with "/".
+SPARSE_DIR_MODE_TYPE = 0b0100
+
+
+class G1tSparseCheckout(object):
+    # Cone mode patterns: everything under the recursive directories, and
+    # the files directly in the root or in one of their parents.
+    def __init__(self, dirs: Iterable[str]) -> None:
+        self.recursive: set[str] = set()
+        self.parents: set[str] = {""}
+        for d in sorted(d.strip("/") + "/" for d in dirs if d.strip("/")):
+            if not self.in_recursive(d):
+                self.recursive.add(d)
+        for d in self.recursive:
+            pos = d.find("/")
+            while pos != len(d) - 1:
+                self.parents.add(d[: pos + 1])
+                pos = d.find("/", pos + 1)
+
+    def in_recursive(self, path: str) -> bool:
+        pos = path.find("/")
+        while pos != -1:
+            if path[: pos + 1] in self.recursive:
+                return True
+            pos = path.find("/", pos + 1)
+        return False
+
+    def includes(self, path: str) -> bool:
+        # Directories are given with a trailing "/", and are included if
+        # anything under them is.
+        if path.endswith("/") and path in self.parents:
+            return True
+        return path[: path.rfind("/") + 1] in self.parents or self.in_recursive(path)
+
+    def outside_dir(self, path: str) -> str | None:
+        # The topmost directory of path outside the cone, if any.
+        pos = path.find("/")
+        while pos != -1:
+            if not self.includes(path[: pos + 1]):
+                return path[: pos + 1]
+            pos = path.find("/", pos + 1)
+        return None
+
+
+def parse_sparse_checkout(lines: Iterable[str]) -> G1tSparseCheckout:
+    # "/A/" includes A, and "!/A/*/" right after it excludes its
+    # subdirectories again: A is then only a parent.
+    dirs: list[str] = []
+    parents: set[str] = set()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#") or line in ("/*", "!/*/"):
+            continue
+        if line.startswith("!/") and line.endswith("/*/"):
+            parents.add(line[2:-2])
+        elif line.startswith("/") and line.endswith("/") and "*" not in line:
+            dirs.append(line[1:])
+        else:
+            raise Exception(f"Not a cone mode sparse-checkout pattern: {line}")
+    return G1tSparseCheckout(d for d in dirs if d not in parents)
+
+
+def serialize_sparse_checkout(sparse: G1tSparseCheckout) -> str:
+    lines = ["/*", "!/*/"]
+    for d in sorted((sparse.parents - {""}) | sparse.recursive):
+        lines.append(f"/{d}")
+        if d not in sparse.recursive:
+            lines.append(f"!/{d}*/")
+    return "\n".join(lines) + "\n"
+
+
+def read_sparse_checkout(repo: Repository) -> G1tSparseCheckout | None:
+    if not config_get_bool(repo.config, "core", "sparsecheckout", False):
+        return None
+    if not config_get_bool(repo.config, "core", "sparsecheckoutcone", True):
+        raise Exception("Only cone mode sparse-checkout is supported")
+    path = repo.gitdir / "info" / "sparse-checkout"
+    if not path.exists():
+        return G1tSparseCheckout([])
+    with open(path) as f:
+        return parse_sparse_checkout(f)
+
+
+def write_sparse_checkout(repo: Repository, sparse: G1tSparseCheckout) -> None:
+    (repo.gitdir / "info").mkdir(exist_ok=True)
+    with open(repo.gitdir / "info" / "sparse-checkout", "w") as f:
+        f.write(serialize_sparse_checkout(sparse))
+
+
+def is_sparse_dir(entry: G1tIndexEntry) -> bool:
+    return entry.mode_type == SPARSE_DIR_MODE_TYPE
+
+
+def skip_worktree_entry(name: str, sha: str) -> G1tIndexEntry:
+    # An entry for a file that is not checked out, so has no stat data.
+    return G1tIndexEntry(
+        (0, 0), (0, 0), 0, 0, 0b1000, 0o644, 0, 0, 0, sha, False, False, name, True
+    )
+
+
+def sparse_dir_entry(name: str, sha: str) -> G1tIndexEntry:
+    return G1tIndexEntry(
+        (0, 0),
+        (0, 0),
+        0,
+        0,
+        SPARSE_DIR_MODE_TYPE,
+        0,
+        0,
+        0,
+        0,
+        sha,
+        False,
+        False,
+        name,
+        True,
+    )
+
+
+def expand_index(
+    repo: Repository, index: G1tIndex, paths: Iterable[str] | None = None
+) -> None:
+    # Replace sparse directory entries with the files of their tree. Only
+    # those holding one of paths, if given.
+    if not index.sparse:
+        return
+    wanted = None
+    if paths is not None:
+        wanted = set()
+        for path in paths:
+            pos = path.find("/")
+            while pos != -1:
+                wanted.add(path[: pos + 1])
+                pos = path.find("/", pos + 1)
+    sparse_dirs = [
+        (name, e)
+        for name, e in index.by_name.items()
+        if is_sparse_dir(e) and (wanted is None or name in wanted)
+    ]
+    for name, entry in sparse_dirs:
+        index.remove(name)
+        files = tree_to_dict(repo, entry.sha, repo.worktree / name)
+        for name, sha in files.items():
+            index.add(skip_worktree_entry(name, sha))
+    if wanted is None:
+        index.sparse = False
+
+
+def collapse_index(
+    repo: Repository, index: G1tIndex, sparse: G1tSparseCheckout
+) -> None:
+    # Replace the entries of each directory outside the cone with a single
+    # sparse directory entry for its tree, as found in the cache-tree.
+    # Directories holding files that are checked out anyway stay expanded.
+    tree_from_index(repo, index)
+    cache_tree = index.cache_tree
+    assert cache_tree is not None
+    names = index.names
+    collapsed: list[str] = []
+    i = 0
+    while i < len(names):
+        d = sparse.outside_dir(names[i])
+        if d is None:
+            i += 1
+            continue
+        j = bisect.bisect_left(names, d[:-1] + "0", i)
+        if names[i] != d and all(
+            index.by_name[n].flag_skip_worktree and not index.by_name[n].flag_stage
+            for n in names[i:j]
+        ):
+            collapsed.append(d)
+        i = j
+    if not collapsed:
+        return
+
+    node_shas = {d: cache_tree_sha(cache_tree, d) for d in collapsed}
+    entries: list[G1tIndexEntry] = []
+    i = 0
+    for d in collapsed:
+        start = bisect.bisect_left(names, d, i)
+        end = bisect.bisect_left(names, d[:-1] + "0", start)
+        entries.extend(index.by_name[n] for n in names[i:start])
+        entries.append(sparse_dir_entry(d, node_shas[d]))
+        i = end
+    entries.extend(index.by_name[n] for n in names[i:])
+
+    # Only the directories above the collapsed ones have fewer entries.
+    index.entries = entries
+    index.cache_tree = cache_tree
+    for d in collapsed:
+        cache_tree.invalidate(d)
+    index.sparse = True
+
+
+def cache_tree_sha(cache_tree: G1tCacheTree, d: str) -> str:
+    node = cache_tree
+    for part in d.split("/")[:-1]:
+        node = node.subtrees[part]
+    assert node.sha is not None
+    return node.sha
+
+
+def update_sparse_worktree(
+    repo: Repository, index: G1tIndex, sparse: G1tSparseCheckout | None
+) -> list[str]:
+    # Check out what entered the cone, and remove what left it. Files
+    # with changes are left alone, and stay expanded in the index, and so
+    # are untracked files in the way of one entering the cone. Returns
+    # warnings about those, for the caller to show.
+    warnings: list[str] = []
+    expand_index(repo, index)
+    for name, entry in list(index.by_name.items()):
+        path = repo.worktree / name
+        included = sparse is None or sparse.includes(name)
+        if included and entry.flag_skip_worktree:
+            if path.exists():
+                if not file_has_sha(path, entry.sha):
+                    warnings.append(f"not overwriting untracked {name}")
+                    continue
+            else:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                checkout_blob(repo, entry.sha, path)
+            index.add(index_entry_from_stat(name, path.stat(), entry.sha))
+        elif not included and not entry.flag_skip_worktree:
+            if path.exists():
+                if not file_has_sha(path, entry.sha):
+                    warnings.append(f"not removing modified {name}")
+                    continue
+                path.unlink()
+                remove_empty_dirs(repo, path.parent)
+            index.add(dataclasses.replace(entry, flag_skip_worktree=True))
+    if sparse is not None and config_get_bool(repo.config, "index", "sparse", False):
+        collapse_index(repo, index, sparse)
+    return warnings
+
+
+def file_has_sha(path: Path, sha: str) -> bool:
+    if not path.is_file():
+        return False
+    with open(path, "rb") as f:
+        file_sha: str = hash_object(f, "blob")
+    return file_sha == sha
+
+
+def remove_empty_dirs(repo: Repository, path: Path) -> None:
+    while path != repo.worktree:
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = path.parent
@@ -0,0 +1,55 @@
+from g1t.core.ewah import ewah_deserialize, ewah_serialize
+from g1t.core.repository import Repository
+from pathlib import Path
+from typing import Any
+import time
+
+# Unreferenced shared indexes are kept this long, in case a process that
+# read the index before it was rewritten still needs its base.
+SHARED_INDEX_EXPIRE = 14 * 24 * 3600
+DEFAULT_SPLIT_INDEX_MAX_PERCENT_CHANGE = 20
+
+
+class G1tSplitIndex(object):
+    # The index "link" extension: the index only holds the entries that
+    # differ from a shared base index, $GIT_DIR/sharedindex.<base_sha>.
+    # Entries of the base at the positions in delete_bitmap are gone; the
+    # first entries of the index replace those in replace_bitmap, in order,
+    # and the rest are new.
+    def __init__(self, base_sha: str) -> None:
+        self.base_sha = base_sha
+        self.delete_bitmap: list[int] = []
+        self.replace_bitmap: list[int] = []
+        # The base's entries, in order, once it has been read. Unchanged
+        # entries of the index are these very objects.
+        self.base_entries: list[Any] = []
+
+
+def parse_link(data: bytes) -> G1tSplitIndex:
+    split = G1tSplitIndex(data[:20].hex())
+    if len(data) > 20:
+        split.delete_bitmap, _, pos = ewah_deserialize(data, 20)
+        split.replace_bitmap, _, _ = ewah_deserialize(data, pos)
+    return split
+
+
+def serialize_link(split: G1tSplitIndex) -> bytes:
+    ret = bytes.fromhex(split.base_sha)
+    for bitmap in (split.delete_bitmap, split.replace_bitmap):
+        ret += ewah_serialize(bitmap, bitmap[-1] + 1 if bitmap else 0)
+    return ret
+
+
+def shared_index_path(repo: Repository, sha: str) -> Path:
+    return repo.gitdir / f"sharedindex.{sha}"
+
+
+def clean_shared_indexes(repo: Repository, keep: str) -> None:
+    # Like git, the base in use gets its mtime refreshed so that it never
+    # looks expired.
+    now = time.time()
+    for path in repo.gitdir.glob("sharedindex.*"):
+        if path.name == f"sharedindex.{keep}":
+            path.touch()
+        elif path.stat().st_mtime < now - SHARED_INDEX_EXPIRE:
+            path.unlink(missing_ok=True)
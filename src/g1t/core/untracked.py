@@ -0,0 +1,336 @@
+from g1t.core.ewah import ewah_deserialize, ewah_serialize
+from g1t.core.varint import decode_varint, encode_varint
+from g1t.core.object import hash_object
+from pathlib import Path
+from typing import Callable, Container
+import os
+import struct
+
+# ctime s/ns, mtime s/ns, dev, ino, uid, gid, size.
+ONDISK_STAT = struct.Struct(">9I")
+NULL_STAT = (0,) * 9
+DIR_FLAGS = struct.Struct(">I")
+# git keys the cache on its status.showUntrackedFiles mode and throws the
+# cache away when the flags differ. g1t lists every untracked file and
+# its ignore rules are not git's, so it uses a value git never does: each
+# tool rebuilds the other's cache instead of trusting it.
+UNTRACKED_DIR_FLAGS = 1 << 30
+
+
+class G1tUntrackedDir(object):
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # Files directly in this directory that are neither tracked nor
+        # ignored.
+        self.untracked: list[str] = []
+        self.dirs: dict[str, "G1tUntrackedDir"] = {}
+        # Stat of the directory when it was listed. Creating, deleting or
+        # renaming a file in it changes its mtime.
+        self.stat: tuple[int, ...] = NULL_STAT
+        # The .gitignore of this directory, if any.
+        self.exclude_sha: str | None = None
+        self.valid = False
+        self.check_only = False
+
+
+class G1tUntrackedCache(object):
+    # The index "UNTR" extension.
+    def __init__(self, ident: bytes) -> None:
+        self.ident = ident
+        self.info_exclude_stat: tuple[int, ...] = NULL_STAT
+        self.info_exclude_sha: str | None = None
+        self.excludes_file_stat: tuple[int, ...] = NULL_STAT
+        self.excludes_file_sha: str | None = None
+        self.dir_flags = UNTRACKED_DIR_FLAGS
+        self.exclude_per_dir = ".gitignore"
+        self.root: G1tUntrackedDir | None = None
+
+    def invalidate(self, path: str) -> None:
+        # Adding or removing path in the index only changes what is
+        # untracked in its own directory.
+        node = self.root
+        for part in path.split("/")[:-1]:
+            if node is None:
+                return
+            node = node.dirs.get(part)
+        if node is not None:
+            node.valid = False
+
+
+def untracked_cache_ident(worktree: Path) -> bytes:
+    # The same string git uses, so that git doesn't complain about it.
+    return f"Location {worktree}, system {os.uname().sysname}\x00".encode("utf8")
+
+
+def stat_data(stat: os.stat_result) -> tuple[int, ...]:
+    return tuple(
+        v & 0xFFFFFFFF
+        for v in (
+            int(stat.st_ctime),
+            stat.st_ctime_ns % 10**9,
+            int(stat.st_mtime),
+            stat.st_mtime_ns % 10**9,
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_uid,
+            stat.st_gid,
+            stat.st_size,
+        )
+    )
+
+
+def read_sha(data: bytes, pos: int) -> str | None:
+    sha = data[pos : pos + 20]
+    return None if sha == bytes(20) else sha.hex()
+
+
+def read_string(data: bytes, pos: int) -> tuple[str, int]:
+    nul = data.index(b"\x00", pos)
+    return data[pos:nul].decode("utf8"), nul + 1
+
+
+def parse_untracked_cache(data: bytes) -> G1tUntrackedCache:
+    ident_length, pos = decode_varint(data, 0)
+    cache = G1tUntrackedCache(data[pos : pos + ident_length])
+    pos += ident_length
+    cache.info_exclude_stat = ONDISK_STAT.unpack_from(data, pos)
+    pos += ONDISK_STAT.size
+    cache.excludes_file_stat = ONDISK_STAT.unpack_from(data, pos)
+    pos += ONDISK_STAT.size
+    (cache.dir_flags,) = DIR_FLAGS.unpack_from(data, pos)
+    pos += DIR_FLAGS.size
+    cache.info_exclude_sha = read_sha(data, pos)
+    cache.excludes_file_sha = read_sha(data, pos + 20)
+    cache.exclude_per_dir, pos = read_string(data, pos + 40)
+
+    dir_count, pos = decode_varint(data, pos)
+    if dir_count == 0:
+        return cache
+
+    # Directory blocks come depth first; the bitmaps and the stat and
+    # SHA arrays that follow refer to directories by that order.
+    dirs: list[G1tUntrackedDir] = []
+    cache.root, pos = parse_untracked_dir(data, pos, dirs)
+    valid, _, pos = ewah_deserialize(data, pos)
+    check_only, _, pos = ewah_deserialize(data, pos)
+    sha_valid, _, pos = ewah_deserialize(data, pos)
+    for i in valid:
+        dirs[i].valid = True
+        dirs[i].stat = ONDISK_STAT.unpack_from(data, pos)
+        pos += ONDISK_STAT.size
+    for i in check_only:
+        dirs[i].check_only = True
+    for i in sha_valid:
+        dirs[i].exclude_sha = read_sha(data, pos)
+        pos += 20
+    return cache
+
+
+def parse_untracked_dir(
+    data: bytes, pos: int, dirs: list[G1tUntrackedDir]
+) -> tuple[G1tUntrackedDir, int]:
+    untracked_count, pos = decode_varint(data, pos)
+    dir_count, pos = decode_varint(data, pos)
+    name, pos = read_string(data, pos)
+    node = G1tUntrackedDir(name)
+    dirs.append(node)
+    for _ in range(untracked_count):
+        untracked, pos = read_string(data, pos)
+        node.untracked.append(untracked)
+    for _ in range(dir_count):
+        child, pos = parse_untracked_dir(data, pos, dirs)
+        node.dirs[child.name] = child
+    return node, pos
+
+
+def serialize_untracked_cache(cache: G1tUntrackedCache) -> bytes:
+    ret = encode_varint(len(cache.ident)) + cache.ident
+    ret += ONDISK_STAT.pack(*cache.info_exclude_stat)
+    ret += ONDISK_STAT.pack(*cache.excludes_file_stat)
+    ret += DIR_FLAGS.pack(cache.dir_flags)
+    for sha in (cache.info_exclude_sha, cache.excludes_file_sha):
+        ret += bytes.fromhex(sha) if sha else bytes(20)
+    ret += cache.exclude_per_dir.encode("utf8") + b"\x00"
+    if cache.root is None:
+        return ret + encode_varint(0)
+
+    dirs: list[G1tUntrackedDir] = []
+    blocks = serialize_untracked_dir(cache.root, dirs)
+    ret += encode_varint(len(dirs)) + blocks
+    ret += serialize_dir_bitmap([i for i, d in enumerate(dirs) if d.valid])
+    ret += serialize_dir_bitmap([i for i, d in enumerate(dirs) if d.check_only])
+    ret += serialize_dir_bitmap([i for i, d in enumerate(dirs) if d.exclude_sha])
+    for d in dirs:
+        if d.valid:
+            ret += ONDISK_STAT.pack(*d.stat)
+    for d in dirs:
+        if d.exclude_sha:
+            ret += bytes.fromhex(d.exclude_sha)
+    # git ends the extension with a NUL as a guard for the string lists.
+    return ret + b"\x00"
+
+
+def serialize_dir_bitmap(positions: list[int]) -> bytes:
+    # Like git's, the bitmap ends with its last set bit.
+    return ewah_serialize(positions, positions[-1] + 1 if positions else 0)
+
+
+def serialize_untracked_dir(
+    node: G1tUntrackedDir, dirs: list[G1tUntrackedDir]
+) -> bytes:
+    dirs.append(node)
+    ret = encode_varint(len(node.untracked))
+    ret += encode_varint(len(node.dirs))
+    ret += node.name.encode("utf8") + b"\x00"
+    for name in node.untracked:
+        ret += name.encode("utf8") + b"\x00"
+    for name in sorted(node.dirs):
+        ret += serialize_untracked_dir(node.dirs[name], dirs)
+    return ret
+
+
+def validate_untracked_cache(
+    cache: G1tUntrackedCache,
+    ident: bytes,
+    info_exclude: Path,
+    excludes_file: Path,
+    exclude_shas: dict[str, str],
+) -> bool:
+    # Drop the cached directories if they were listed somewhere else, or
+    # with other ignore rules. g1t's ignore rules are not limited to the
+    # directory of their .gitignore, so any change drops everything.
+    # exclude_shas maps the path of each .gitignore to its blob.
+    info_exclude_stat, info_exclude_sha = stat_and_hash(info_exclude)
+    excludes_file_stat, excludes_file_sha = stat_and_hash(excludes_file)
+    valid = (
+        cache.root is not None
+        and cache.ident == ident
+        and cache.dir_flags == UNTRACKED_DIR_FLAGS
+        and cache.info_exclude_sha == info_exclude_sha
+        and cache.excludes_file_sha == excludes_file_sha
+        and same_exclude_shas(cache.root, "", exclude_shas)
+    )
+    if not valid:
+        cache.ident = ident
+        cache.dir_flags = UNTRACKED_DIR_FLAGS
+        cache.info_exclude_stat = info_exclude_stat
+        cache.info_exclude_sha = info_exclude_sha
+        cache.excludes_file_stat = excludes_file_stat
+        cache.excludes_file_sha = excludes_file_sha
+        cache.root = None
+    return valid
+
+
+def stat_and_hash(path: Path) -> tuple[tuple[int, ...], str | None]:
+    try:
+        with open(path, "rb") as f:
+            return stat_data(os.fstat(f.fileno())), hash_object(f, "blob")
+    except FileNotFoundError:
+        return NULL_STAT, None
+
+
+def same_exclude_shas(
+    node: G1tUntrackedDir, prefix: str, exclude_shas: dict[str, str]
+) -> bool:
+    if node.exclude_sha != exclude_shas.get(prefix + ".gitignore"):
+        return False
+    return all(
+        same_exclude_shas(child, prefix + name + "/", exclude_shas)
+        for name, child in node.dirs.items()
+    )
+
+
+def update_untracked_cache(
+    cache: G1tUntrackedCache,
+    worktree: Path,
+    tracked: Container[str],
+    is_ignored: Callable[[str], bool],
+    exclude_shas: dict[str, str],
+    fsmonitor: bool = False,
+) -> bool:
+    # Bring the cache up to date with the worktree. Only directories whose
+    # stat changed, or that were invalidated by an index change, are
+    # listed again; the others are stat'ed and their cached untracked
+    # files reused. With fsmonitor, which invalidates the directories
+    # with changes, valid directories are not even stat'ed. Returns
+    # whether anything changed.
+    if cache.root is None:
+        cache.root = G1tUntrackedDir("")
+    return update_untracked_dir(
+        cache.root, worktree, "", tracked, is_ignored, exclude_shas, fsmonitor
+    )
+
+
+def update_untracked_dir(
+    node: G1tUntrackedDir,
+    worktree: Path,
+    prefix: str,
+    tracked: Container[str],
+    is_ignored: Callable[[str], bool],
+    exclude_shas: dict[str, str],
+    fsmonitor: bool = False,
+) -> bool:
+    path = worktree / prefix if prefix else worktree
+    changed = False
+    if fsmonitor and node.valid:
+        stat = node.stat
+    else:
+        try:
+            stat = stat_data(os.stat(path))
+        except FileNotFoundError:
+            stat = NULL_STAT
+
+    if not node.valid or node.stat != stat:
+        # Take the stat before listing: a file created while we list
+        # changes the mtime again and gets picked up next time.
+        node.stat = stat
+        untracked: list[str] = []
+        dirs: dict[str, G1tUntrackedDir] = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name == ".git" and not prefix:
+                        continue
+                    name = prefix + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        # Ignored directories are not even entered.
+                        if not is_ignored(name + "/"):
+                            dirs[entry.name] = node.dirs.get(
+                                entry.name
+                            ) or G1tUntrackedDir(entry.name)
+                        continue
+                    if name not in tracked and not is_ignored(name):
+                        untracked.append(entry.name)
+        except FileNotFoundError:
+            pass
+        node.untracked = sorted(untracked)
+        node.dirs = dirs
+        node.exclude_sha = exclude_shas.get(prefix + ".gitignore")
+        node.valid = True
+        changed = True
+
+    for name, child in node.dirs.items():
+        if update_untracked_dir(
+            child,
+            worktree,
+            prefix + name + "/",
+            tracked,
+            is_ignored,
+            exclude_shas,
+            fsmonitor,
+        ):
+            changed = True
+    return changed
+
+
+def list_untracked(cache: G1tUntrackedCache) -> list[str]:
+    ret: list[str] = []
+    if cache.root is not None:
+        list_untracked_dir(cache.root, "", ret)
+    return ret
+
+
+def list_untracked_dir(node: G1tUntrackedDir, prefix: str, ret: list[str]) -> None:
+    ret.extend(prefix + name for name in node.untracked)
+    for name in sorted(node.dirs):
+        list_untracked_dir(node.dirs[name], prefix + name + "/", ret)
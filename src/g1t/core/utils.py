@@ -1,6 +1,7 @@
 from g1t.core.repository import Repository
 from g1t.core.object import find_object, read_object, G1tTree
 from pathlib import Path
+from typing import Callable, Iterator
 import os
 import configparser
 
@@ -32,6 +33,35 @@ def tree_to_dict(repo: Repository, tree_ref: str, prefix: Path) -> dict[str, str
     return dst
 
 
+def walk_worktree(
+    worktree: Path, is_ignored: Callable[[str], bool], prefix: str = ""
+) -> Iterator[tuple[str, os.DirEntry[str]]]:
+    # Lazily yield the path relative to worktree and the DirEntry of
+    # every file, in path order. .git and the directories is_ignored
+    # returns True for ("dir/") are not entered. The DirEntry caches
+    # what scandir already knows, and the stat once taken.
+    try:
+        with os.scandir(worktree / prefix) as it:
+            entries = sorted(it, key=walk_sort_key)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            path = prefix + entry.name + "/"
+            if entry.name != ".git" and not is_ignored(path):
+                yield from walk_worktree(worktree, is_ignored, path)
+        else:
+            yield prefix + entry.name, entry
+
+
+def walk_sort_key(entry: os.DirEntry[str]) -> str:
+    # Like git, a directory sorts as "name/", so that "a.txt" comes
+    # before "a/x".
+    if entry.is_dir(follow_symlinks=False):
+        return entry.name + "/"
+    return entry.name
+
+
 def read_gitconfig() -> configparser.ConfigParser:
     xdg_config_home = (
         os.environ["XDG_CONFIG_HOME"]
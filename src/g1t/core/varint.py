@@ -0,0 +1,28 @@
+import mmap
+
+# git's varint.c: big-endian 7 bits per byte, where each continuation
+# adds one, so that every length covers a distinct range of values. Used
+# by OFS_DELTA base offsets, index v4 name prefixes and the untracked
+# cache.
+
+
+def encode_varint(value: int) -> bytes:
+    ret = [value & 0x7F]
+    value >>= 7
+    while value:
+        value -= 1
+        ret.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(ret))
+
+
+def decode_varint(data: bytes | mmap.mmap, pos: int) -> tuple[int, int]:
+    # Returns the value and the position just past it.
+    c = data[pos]
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7F)
+    return value, pos
@@ -1,5 +1,6 @@
 from g1t.cmd.add import cmd_add
 from git import Repo, IndexEntry
+from pathlib import Path
 import pytest
 
 
@@ -43,3 +44,22 @@ def test_add() -> None:
     g1t_indexed_files = [b[1] for b in repo.index.entries.items()]
 
     compare_two_indexed_files(original_git_indexed_files, g1t_indexed_files)
+
+
+def test_add_split_index() -> None:
+    repo = Repo(pytest.PROJECT_ROOT)
+    with repo.config_writer() as cw:
+        cw.set_value("core", "splitIndex", "true")
+    original_git_indexed_files = repo.git.ls_files("-s").splitlines()
+
+    # The first write creates the shared index, the second only records
+    # the new file in the link extension.
+    add_test_sample_file()
+    cmd_add([SAMPLE_FILE_PATH])
+    cmd_add([SAMPLE_FILE_PATH])
+    assert len(list(Path(repo.git_dir).glob("sharedindex.*"))) == 1
+    g1t_indexed_files = repo.git.ls_files("-s").splitlines()
+    SAMPLE_FILE_PATH.unlink()
+
+    assert len(g1t_indexed_files) == len(original_git_indexed_files) + 1
+    assert set(original_git_indexed_files) < set(g1t_indexed_files)
@@ -1,6 +1,11 @@
 from g1t.cmd import cat_file
-from g1t.core.object import G1tCommit, G1tTree
+from g1t.core.object import G1tCommit, G1tTree, read_raw_object
+from g1t.core.pack import OBJ_OFS_DELTA, OBJ_REF_DELTA, get_packs
+from g1t.core.repository import Repository
 from pathlib import Path
+import io
+import random
+import pytest
 from git import Repo
 
 PROJECT_ROOT = Path(__file__).parent.parent.parent
@@ -36,3 +41,97 @@ def test_cat_tree() -> None:
         assert g1t_entry.sha == original_entry.hexsha
         assert g1t_entry.path == original_entry.name
         assert g1t_entry.mode == oct(original_entry.mode)[2:].encode("utf-8").zfill(6)
+
+
+def test_cat_packed_commit() -> None:
+    repo = Repo(PROJECT_ROOT)
+    repo.git.gc()
+    commit = repo.commit("HEAD")
+
+    obj = cat_file.cmd_cat_file(commit.hexsha)
+    assert isinstance(obj, G1tCommit)
+    assert obj.kvlm[b"tree"] == commit.tree.hexsha.encode()
+
+    tree = cat_file.cmd_cat_file(commit.tree.hexsha)
+    assert isinstance(tree, G1tTree)
+    assert [e.sha for e in tree.items] == [e.hexsha for e in commit.tree]
+
+
+def test_cat_file_batch() -> None:
+    repo = Repo(PROJECT_ROOT)
+    commit = repo.commit("HEAD")
+    names = io.BytesIO(f"{commit.hexsha}\n{commit.tree.hexsha}\nnope\n".encode())
+    out = io.BytesIO()
+
+    cat_file.cmd_cat_file_batch(names, out, contents=False)
+
+    assert out.getvalue().decode().splitlines() == [
+        f"{commit.hexsha} commit {commit.size}",
+        f"{commit.tree.hexsha} tree {commit.tree.size}",
+        "nope missing",
+    ]
+
+
+def make_file_history(path: Path) -> Repo:
+    # Each commit rewrites more lines of the same file: git stores the
+    # versions as delta chains. Deltas with enough literal data are
+    # compressed with a dynamic Huffman table, which takes more than a few
+    # bytes before any output.
+    repo = Repo.init(path)
+    rng = random.Random(0)
+    lines = ["".join(rng.choices("abcdefghij", k=40)) for _ in range(300)]
+    for i in range(10):
+        for j in range(i, len(lines), 7):
+            lines[j] = "".join(rng.choices("abcdefghij", k=40))
+        (path / "file.txt").write_text("\n".join(lines))
+        repo.index.add(["file.txt"])
+        repo.index.commit(f"commit {i}")
+    return repo
+
+
+def test_cat_file_batch_check_aggressive_pack(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = make_file_history(tmp_path)
+    repo.git.gc("--aggressive")
+    expected = repo.git.cat_file("--batch-check", "--batch-all-objects")
+
+    monkeypatch.chdir(tmp_path)
+    names = io.BytesIO(
+        "".join(line.split()[0] + "\n" for line in expected.splitlines()).encode()
+    )
+    out = io.BytesIO()
+    cat_file.cmd_cat_file_batch(names, out, contents=False)
+
+    assert out.getvalue().decode().splitlines() == expected.splitlines()
+
+
+@pytest.mark.parametrize(
+    "delta_type, offset_config",
+    [(OBJ_OFS_DELTA, "true"), (OBJ_REF_DELTA, "false")],
+)
+def test_read_packed_delta_chains(
+    tmp_path: Path, delta_type: int, offset_config: str
+) -> None:
+    repo = make_file_history(tmp_path)
+    repo.git.config("repack.useDeltaBaseOffset", offset_config)
+    repo.git.repack("-a", "-d", "-f", "--depth=50")
+    verify = repo.git.verify_pack(
+        "-v", *map(str, tmp_path.glob(".git/objects/pack/*.idx"))
+    )
+    assert "chain length = 3" in verify
+
+    g1t_repo = Repository(tmp_path)
+    (pack,) = get_packs(g1t_repo)
+    types = {
+        pack.read_entry_header(pack.index.offset_at(i))[0]
+        for i in range(pack.index.count)
+    }
+    assert delta_type in types
+    for i in range(pack.index.count):
+        sha = pack.index.sha_at(i)
+        stream = repo.odb.stream(sha)
+        assert read_raw_object(g1t_repo, sha.hex()) == (
+            stream.type.decode(),
+            stream.read(),
+        )
@@ -30,3 +30,25 @@ def test_commit() -> None:
     assert commit.author.email == pytest.GIT_USER_EMAIL
     assert commit.committer.name == pytest.GIT_USER_NAME
     assert commit.committer.email == pytest.GIT_USER_EMAIL
+
+
+def test_commit_tree_matches_index() -> None:
+    add_test_sample_file()
+    repo = Repo(PROJECT_ROOT)
+    repo.index.add([SAMPLE_FILE_PATH])
+    cmd_commit("Commit twice")
+    cmd_commit("Reuse cached trees")
+
+    # The second commit's tree comes from the cache-tree written back by
+    # the first one.
+    head = repo.commit("HEAD")
+    assert head.tree == head.parents[0].tree
+    # "<mode> blob <sha>\t<path>" and "<mode> <sha> 0\t<path>"
+    tree_entries = [
+        line.replace(" blob ", " ")
+        for line in repo.git.ls_tree("-r", "HEAD").splitlines()
+    ]
+    index_entries = [
+        line.replace(" 0\t", "\t") for line in repo.git.ls_files("-s").splitlines()
+    ]
+    assert tree_entries == index_entries
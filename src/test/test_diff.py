@@ -0,0 +1,127 @@
+from g1t.core.diff import Side, diff_tree_index
+from g1t.core.index import read_index
+from g1t.core.repository import Repository
+from g1t.core.sparse import sparse_dir_entry
+from pathlib import Path
+from typing import Any
+from git import Repo
+import g1t.core.diff
+import pytest
+
+NAMES = ["a/one.txt", "a/two.txt", "b/c/x.txt", "b/c/y.txt", "b/z.txt", "top.txt"]
+
+
+def make_repo(path: Path) -> Repo:
+    repo = Repo.init(path)
+    with repo.config_writer() as cw:
+        cw.set_value("user", "name", pytest.GIT_USER_NAME)
+        cw.set_value("user", "email", pytest.GIT_USER_EMAIL)
+    for name in NAMES:
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_text(name)
+    repo.git.add(".")
+    repo.git.commit("-m", "first")
+    return repo
+
+
+def git_diff_cached(repo: Repo) -> list[tuple[str, Side, Side]]:
+    ret = []
+    for line in repo.git.diff_index("--cached", "--no-renames", "HEAD").splitlines():
+        meta, path = line.split("\t")
+        old_mode, new_mode, old_sha, new_sha, _ = meta[1:].split(" ")
+        old = (old_mode, old_sha) if old_mode != "000000" else None
+        new = (new_mode, new_sha) if new_mode != "000000" else None
+        ret.append((path, old, new))
+    return ret
+
+
+def count_tree_reads(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    reads: list[str] = []
+    read_object = g1t.core.diff.read_object
+
+    def counting_read_object(repo: Repository, sha: str) -> Any:
+        reads.append(sha)
+        return read_object(repo, sha)
+
+    monkeypatch.setattr(g1t.core.diff, "read_object", counting_read_object)
+    return reads
+
+
+def test_diff_tree_index(tmp_path: Path) -> None:
+    repo = make_repo(tmp_path)
+    (tmp_path / "b/c/x.txt").write_text("changed")
+    (tmp_path / "b/c.txt").write_text("between c and c/")
+    (tmp_path / "new/file.txt").parent.mkdir()
+    (tmp_path / "new/file.txt").write_text("new")
+    (tmp_path / "top.txt").chmod(0o755)
+    repo.git.add(".")
+    repo.git.rm("--cached", "-q", "a/two.txt")
+    # A file replacing a directory.
+    repo.git.rm("--cached", "-q", "-r", "a")
+    (tmp_path / "a.txt").write_text("a")
+    repo.git.add("a.txt")
+
+    g1t_repo = Repository(tmp_path)
+    index = read_index(g1t_repo)
+    head = repo.head.commit.tree.hexsha
+    expected = git_diff_cached(repo)
+    assert list(diff_tree_index(g1t_repo, head, index)) == expected
+    # Without a cache-tree, every directory is compared.
+    index.cache_tree = None
+    assert list(diff_tree_index(g1t_repo, head, index)) == expected
+
+
+def test_diff_tree_index_skips_cached_trees(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = make_repo(tmp_path)
+    g1t_repo = Repository(tmp_path)
+    head = repo.head.commit.tree
+    reads = count_tree_reads(monkeypatch)
+
+    # git commit leaves a valid cache-tree: nothing to read.
+    assert list(diff_tree_index(g1t_repo, head.hexsha, read_index(g1t_repo))) == []
+    assert reads == []
+
+    # Only the directories above the change are read.
+    (tmp_path / "b/c/y.txt").write_text("changed")
+    repo.git.add("b/c/y.txt")
+    changes = list(diff_tree_index(g1t_repo, head.hexsha, read_index(g1t_repo)))
+    assert changes == git_diff_cached(repo)
+    assert sorted(reads) == sorted([head.hexsha, head["b"].hexsha, head["b/c"].hexsha])
+
+
+def test_diff_tree_index_sparse_dir(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = make_repo(tmp_path)
+    old_b = repo.head.commit.tree["b"]
+    (tmp_path / "b/c/x.txt").write_text("changed")
+    repo.git.commit("-a", "-m", "second")
+    head = repo.head.commit.tree
+    g1t_repo = Repository(tmp_path)
+
+    def sparse_index(b_sha: str) -> Any:
+        index = read_index(g1t_repo)
+        for name in [n for n in index.names if n.startswith("b/")]:
+            index.remove(name)
+        index.add(sparse_dir_entry("b/", b_sha))
+        return index
+
+    # The same tree as HEAD: nothing under b/ is read.
+    reads = count_tree_reads(monkeypatch)
+    assert (
+        list(diff_tree_index(g1t_repo, head.hexsha, sparse_index(head["b"].hexsha)))
+        == []
+    )
+    assert head["b"].hexsha not in reads
+
+    # Another tree: compared tree to tree, down to the files.
+    changes = list(diff_tree_index(g1t_repo, head.hexsha, sparse_index(old_b.hexsha)))
+    assert changes == [
+        (
+            "b/c/x.txt",
+            ("100644", head["b/c/x.txt"].hexsha),
+            ("100644", old_b["c/x.txt"].hexsha),
+        )
+    ]
@@ -0,0 +1,72 @@
+from g1t.core.fsmonitor import (
+    FSMONITOR_TRIVIAL,
+    IN_CREATE,
+    IN_ISDIR,
+    IN_MODIFY,
+    IN_Q_OVERFLOW,
+    G1tFsmonitorDaemon,
+    parse_fsmonitor,
+    serialize_fsmonitor,
+)
+from g1t.core.repository import Repository
+from pathlib import Path
+from typing import Generator
+import os
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.platform != "linux", reason="inotify")
+
+
+@pytest.fixture
+def daemon(tmp_path: Path) -> Generator[G1tFsmonitorDaemon, None, None]:
+    (tmp_path / ".git").mkdir()
+    (tmp_path / "dir").mkdir()
+    daemon = G1tFsmonitorDaemon(Repository(tmp_path))
+    daemon.watch("")
+    yield daemon
+    os.close(daemon.fd)
+
+
+def test_fsmonitor_extension_round_trip() -> None:
+    data = serialize_fsmonitor("g1t-1-2:3", [0, 5, 64, 200])
+    assert parse_fsmonitor(data) == ("g1t-1-2:3", [0, 5, 64, 200])
+    assert parse_fsmonitor(serialize_fsmonitor("token", [])) == ("token", [])
+
+
+def test_fsmonitor_unknown_token(daemon: G1tFsmonitorDaemon) -> None:
+    for token in ("", "other-daemon:0", f"{daemon.id}:nope"):
+        _, paths = daemon.answer(token)
+        assert paths == [FSMONITOR_TRIVIAL]
+
+
+def test_fsmonitor_changed_paths(daemon: G1tFsmonitorDaemon, tmp_path: Path) -> None:
+    token, _ = daemon.answer("")
+    (tmp_path / "new").mkdir()
+    daemon.handle_event(daemon.watches[""], IN_MODIFY, "a.txt")
+    daemon.handle_event(daemon.watches["dir/"], IN_MODIFY, "b.txt")
+    daemon.handle_event(daemon.watches[""], IN_CREATE | IN_ISDIR, "new")
+    token, paths = daemon.answer(token)
+    assert sorted(paths) == ["a.txt", "dir/b.txt", "new/"]
+    # Changes are only reported once, and new directories are watched.
+    assert "new/" in daemon.watches
+    assert daemon.answer(token)[1] == []
+
+
+def test_fsmonitor_inotify_events(daemon: G1tFsmonitorDaemon, tmp_path: Path) -> None:
+    token, _ = daemon.answer("")
+    (tmp_path / "dir" / "file.txt").write_text("changed")
+    (tmp_path / ".git" / "index").write_text("not reported")
+    _, paths = daemon.answer(token)
+    assert paths == ["dir/file.txt"]
+
+
+def test_fsmonitor_overflow(daemon: G1tFsmonitorDaemon) -> None:
+    # Lost events make every token handed out so far stale.
+    token, _ = daemon.answer("")
+    daemon.handle_event(daemon.watches[""], IN_MODIFY, "a.txt")
+    daemon.handle_event(-1, IN_Q_OVERFLOW, "")
+    new_token, paths = daemon.answer(token)
+    assert paths == [FSMONITOR_TRIVIAL]
+    daemon.handle_event(daemon.watches[""], IN_MODIFY, "b.txt")
+    assert daemon.answer(new_token)[1] == ["b.txt"]
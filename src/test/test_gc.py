@@ -0,0 +1,78 @@
+from g1t.cmd import cmd_gc, cat_file
+from g1t.core.object import G1tCommit
+from pathlib import Path
+from git import Repo
+import g1t.core.pack
+import os
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+def test_gc() -> None:
+    repo = Repo(PROJECT_ROOT)
+    head = repo.commit("HEAD")
+
+    cmd_gc()
+
+    packs = list((PROJECT_ROOT / ".git" / "objects" / "pack").glob("*.pack"))
+    assert len(packs) == 1
+    # git must be able to read everything we packed.
+    repo.git.fsck("--full", "--strict")
+
+    obj = cat_file.cmd_cat_file(head.hexsha)
+    assert isinstance(obj, G1tCommit)
+    assert obj.kvlm[b"tree"] == head.tree.hexsha.encode()
+
+
+def test_gc_keeps_staged_objects() -> None:
+    # A blob that is staged but not committed, and only in an old pack.
+    repo = Repo(PROJECT_ROOT)
+    sample = PROJECT_ROOT / "gc_sample.txt"
+    sample.write_text("staged, never committed\n")
+    try:
+        repo.git.add(sample)
+        blob = repo.git.rev_parse(":gc_sample.txt")
+        repo.git.repack("-a", "-d")
+        repo.git.prune_packed()
+
+        cmd_gc()
+
+        repo.git.cat_file("-e", blob)
+        repo.git.fsck("--full", "--strict")
+    finally:
+        sample.unlink()
+
+
+def test_gc_follows_symbolic_refs() -> None:
+    # As in a clone: refs/remotes/origin/HEAD holds "ref: <refname>",
+    # here to a branch that is only in packed-refs.
+    repo = Repo(PROJECT_ROOT)
+    repo.git.branch("gc-packed", "HEAD")
+    repo.git.pack_refs("--all")
+    repo.git.symbolic_ref("refs/remotes/origin/HEAD", "refs/heads/gc-packed")
+    repo.git.symbolic_ref("refs/remotes/origin/dangling", "refs/heads/missing")
+
+    cmd_gc()
+
+    (PROJECT_ROOT / ".git" / "refs" / "remotes" / "origin" / "dangling").unlink()
+    repo.git.fsck("--full", "--strict")
+
+
+def test_gc_writes_idx_after_pack(monkeypatch: pytest.MonkeyPatch) -> None:
+    # A reader finding the .idx must be able to open its .pack.
+    repo = Repo(PROJECT_ROOT)
+    repo.git.config("core.fsync", "pack")
+    write_pack_index = g1t.core.pack.write_pack_index
+    fsynced: list[int] = []
+
+    def checking_write_pack_index(path: Path, *args: object) -> None:
+        assert path.with_suffix(".pack").exists()
+        write_pack_index(path, *args)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(g1t.core.pack, "write_pack_index", checking_write_pack_index)
+    monkeypatch.setattr(os, "fsync", fsynced.append)
+    cmd_gc()
+
+    # The .pack and the .idx.
+    assert len(fsynced) == 2
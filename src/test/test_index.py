@@ -0,0 +1,221 @@
+from g1t.core.index import (
+    G1tIndex,
+    add_to_index,
+    index_entry_from_stat,
+    index_transaction,
+    read_index,
+    read_index_file,
+    rm_from_index,
+    write_index,
+)
+from g1t.core.ewah import ewah_deserialize, ewah_serialize
+from g1t.core.object import hash_object
+from g1t.core.repository import Repository
+from g1t.core.untracked import (
+    G1tUntrackedCache,
+    G1tUntrackedDir,
+    list_untracked,
+    parse_untracked_cache,
+    serialize_untracked_cache,
+    untracked_cache_ident,
+)
+from pathlib import Path
+from typing import BinaryIO
+from git import Repo
+import dataclasses
+import g1t.core.index
+import io
+import pytest
+
+
+def test_racily_modified_entry_is_smudged(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    path = tmp_path / "file.txt"
+    path.write_text("aaaa")
+    old_sha = hash_object(io.BytesIO(b"aaaa"), "blob", None)
+    # Changed in the same instant the index was written, without a
+    # change in size: the stat data still matches the old content.
+    path.write_text("bbbb")
+    stat = path.stat()
+    index = G1tIndex()
+    entry = index_entry_from_stat("file.txt", stat, old_sha)
+    index.add(dataclasses.replace(entry, uptodate=False))
+    index.mtime_ns = stat.st_mtime_ns
+
+    repo = Repository(tmp_path)
+    write_index(repo, index)
+
+    assert read_index(repo).by_name["file.txt"].fsize == 0
+    assert git_repo.git.status("--porcelain") == "AM file.txt"
+
+
+@pytest.mark.parametrize(
+    "positions, bit_size",
+    [
+        ([], 0),
+        ([0], 1),
+        ([3, 64, 65, 200], 201),
+        # Runs of clean words, all zeros then all ones, then literals.
+        ([*range(640, 1280), 1300, 1400], 1500),
+    ],
+)
+def test_ewah_round_trip(positions: list[int], bit_size: int) -> None:
+    data = ewah_serialize(positions, bit_size)
+    assert ewah_deserialize(data + b"rest") == (positions, bit_size, len(data))
+
+
+def test_untracked_cache_round_trip() -> None:
+    cache = G1tUntrackedCache(b"Location /repo, system Linux\x00")
+    cache.info_exclude_sha = "11" * 20
+    cache.root = G1tUntrackedDir("")
+    cache.root.untracked = ["b.txt", "a.txt"]
+    cache.root.valid = True
+    cache.root.stat = tuple(range(1, 10))
+    sub = G1tUntrackedDir("sub")
+    sub.untracked = ["x"]
+    sub.exclude_sha = "22" * 20
+    sub.check_only = True
+    cache.root.dirs["sub"] = sub
+
+    data = serialize_untracked_cache(cache)
+    parsed = parse_untracked_cache(data)
+
+    assert serialize_untracked_cache(parsed) == data
+    assert parsed.ident == cache.ident
+    assert parsed.info_exclude_sha == "11" * 20
+    assert parsed.excludes_file_sha is None
+    assert parsed.root is not None and parsed.root.valid
+    assert parsed.root.stat == tuple(range(1, 10))
+    assert not parsed.root.dirs["sub"].valid
+    assert parsed.root.dirs["sub"].check_only
+    assert parsed.root.dirs["sub"].exclude_sha == "22" * 20
+    assert list_untracked(parsed) == ["b.txt", "a.txt", "sub/x"]
+
+
+def test_read_git_untracked_cache(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    git_repo.git.config("status.showUntrackedFiles", "all")
+    (tmp_path / "tracked.txt").write_text("tracked")
+    git_repo.index.add(["tracked.txt"])
+    (tmp_path / ".gitignore").write_text("*.log\n")
+    (tmp_path / "ignored.log").write_text("ignored")
+    (tmp_path / "dir" / "sub").mkdir(parents=True)
+    (tmp_path / "dir" / "x.txt").write_text("x")
+    (tmp_path / "dir" / "sub" / "y.txt").write_text("y")
+    git_repo.git.update_index("--untracked-cache")
+    untracked = git_repo.git.ls_files("--others", "--exclude-standard")
+    git_repo.git.status()
+
+    _, _, extensions = read_index_file(tmp_path / ".git" / "index")
+    data = bytes(extensions[b"UNTR"])
+    cache = parse_untracked_cache(data)
+
+    assert cache.ident == untracked_cache_ident(tmp_path)
+    assert cache.root is not None and cache.root.valid
+    assert sorted(list_untracked(cache)) == sorted(untracked.splitlines())
+    assert serialize_untracked_cache(cache) == data
+
+
+def make_worktree(root: Path, names: list[str]) -> None:
+    for name in names:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text(name)
+
+
+# Names sharing long prefixes, for index v4 prefix compression.
+INDEX_NAMES = ["a.txt", "dir/sub/deep/one.txt", "dir/sub/deep/two.txt", "dir/z"]
+
+
+@pytest.mark.parametrize("version, written", [(2, 3), (4, 4)])
+def test_index_extended_flags_round_trip(
+    tmp_path: Path, version: int, written: int
+) -> None:
+    # A skip-worktree entry needs extended flags, so version 2 becomes 3.
+    git_repo = Repo.init(tmp_path)
+    make_worktree(tmp_path, INDEX_NAMES)
+    repo = Repository(tmp_path)
+    index = G1tIndex(version=version)
+    for name in INDEX_NAMES:
+        with open(tmp_path / name, "rb") as f:
+            sha = hash_object(f, "blob", repo)
+        index.add(index_entry_from_stat(name, (tmp_path / name).stat(), sha))
+    skipped = "dir/sub/deep/two.txt"
+    index.add(dataclasses.replace(index.by_name[skipped], flag_skip_worktree=True))
+    write_index(repo, index)
+
+    read = read_index(repo)
+    assert read.version == written
+    assert read.entries == index.entries
+    assert [e.name for e in read.entries if e.flag_skip_worktree] == [skipped]
+    tags = git_repo.git.ls_files("-t").splitlines()
+    assert tags == [f"{'S' if n == skipped else 'H'} {n}" for n in INDEX_NAMES]
+
+
+def test_read_git_index_v4(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    make_worktree(tmp_path, INDEX_NAMES)
+    git_repo.git.add(".")
+    git_repo.git.update_index("--index-version", "4")
+    git_repo.git.update_index("--skip-worktree", "dir/z")
+
+    index = read_index(Repository(tmp_path))
+
+    assert index.version == 4
+    assert [
+        f"{e.mode_type:o}{e.mode_perms:04o} {e.sha} 0\t{e.name}" for e in index.entries
+    ] == git_repo.git.ls_files("-s").splitlines()
+    assert [e.name for e in index.entries if e.flag_skip_worktree] == ["dir/z"]
+
+
+def count_index_locks(monkeypatch: pytest.MonkeyPatch) -> list[Path]:
+    locks: list[Path] = []
+    lock_index = g1t.core.index.lock_index
+
+    def counting_lock_index(repo: Repository) -> BinaryIO:
+        locks.append(repo.gitdir / "index.lock")
+        return lock_index(repo)
+
+    monkeypatch.setattr(g1t.core.index, "lock_index", counting_lock_index)
+    return locks
+
+
+def test_index_transaction_locks_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    git_repo = Repo.init(tmp_path)
+    make_worktree(tmp_path, INDEX_NAMES)
+    git_repo.git.add("a.txt")
+    repo = Repository(tmp_path)
+    locks = count_index_locks(monkeypatch)
+
+    with index_transaction(repo) as index:
+        for name in INDEX_NAMES[1:]:
+            add_to_index(repo, index, [tmp_path / name])
+        rm_from_index(repo, index, [tmp_path / "a.txt"], delete=False)
+
+    assert len(locks) == 1
+    assert not (tmp_path / ".git" / "index.lock").exists()
+    assert git_repo.git.ls_files().splitlines() == INDEX_NAMES[1:]
+
+
+def test_index_transaction_failure_keeps_index(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    make_worktree(tmp_path, INDEX_NAMES)
+    git_repo.git.add("a.txt")
+    repo = Repository(tmp_path)
+    before = (tmp_path / ".git" / "index").read_bytes()
+
+    with pytest.raises(ValueError):
+        with index_transaction(repo) as index:
+            add_to_index(repo, index, [tmp_path / INDEX_NAMES[1]])
+            # Nobody else can write the index meanwhile.
+            with pytest.raises(Exception, match="index.lock': File exists"):
+                write_index(repo, read_index(repo))
+            raise ValueError("failed halfway")
+
+    assert not (tmp_path / ".git" / "index.lock").exists()
+    assert (tmp_path / ".git" / "index").read_bytes() == before
+    # The lock was released: the next transaction goes through.
+    with index_transaction(repo) as index:
+        add_to_index(repo, index, [tmp_path / INDEX_NAMES[1]])
+    assert git_repo.git.ls_files().splitlines() == INDEX_NAMES[:2]
@@ -0,0 +1,108 @@
+from g1t import main
+from g1t.core.object import (
+    checkout_blob,
+    get_object_cache,
+    hash_object,
+    read_object_stream,
+    read_raw_object,
+)
+from g1t.core.pack import STREAM_CHUNK_SIZE
+from g1t.core.repository import Repository
+from click.testing import CliRunner
+from pathlib import Path
+from git import Repo
+import random
+import pytest
+import subprocess
+
+
+def git_cat_blob(path: Path, sha: str) -> bytes:
+    # Not through GitPython, which strips the trailing newline.
+    return subprocess.run(
+        ["git", "cat-file", "blob", sha], cwd=path, capture_output=True, check=True
+    ).stdout
+
+
+def write_blobs(repo: Repo, path: Path, sizes: list[int]) -> list[str]:
+    files = []
+    for i, size in enumerate(sizes):
+        files.append(path / f"blob{i}")
+        files[-1].write_bytes(bytes([i]) * size)
+    return repo.git.hash_object("-w", *files).splitlines()
+
+
+def test_object_cache_limit(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    git_repo.git.config("core.objectCacheLimit", "1k")
+    shas = write_blobs(git_repo, tmp_path, [300, 300, 300, 300, 2000])
+    repo = Repository(tmp_path)
+
+    for sha in shas:
+        read_raw_object(repo, sha)
+
+    cache = get_object_cache(repo)
+    assert cache is not None and cache.limit == 1024
+    # The oldest small blob was evicted, and the large one never fit.
+    assert cache.size <= cache.limit
+    assert [sha in cache for sha in shas] == [False, True, True, True, False]
+    read_raw_object(repo, shas[1])
+    assert cache.hits == 1
+
+
+def test_object_cache_disabled(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    git_repo.git.config("core.objectCacheLimit", "0")
+    shas = write_blobs(git_repo, tmp_path, [300])
+    repo = Repository(tmp_path)
+
+    assert read_raw_object(repo, shas[0]) == ("blob", bytes([0]) * 300)
+    assert get_object_cache(repo) is None
+    assert repo.object_cache is None
+
+
+def make_large_file(path: Path) -> bytes:
+    # Several stream chunks, and not a multiple of the chunk size.
+    data = random.Random(0).randbytes(3 * STREAM_CHUNK_SIZE + 123)
+    path.write_bytes(data)
+    return data
+
+
+def test_hash_object_streams_large_file(tmp_path: Path) -> None:
+    git_repo = Repo.init(tmp_path)
+    data = make_large_file(tmp_path / "large.bin")
+
+    with open(tmp_path / "large.bin", "rb") as f:
+        sha = hash_object(f, "blob", Repository(tmp_path))
+
+    assert sha == git_repo.git.hash_object(tmp_path / "large.bin")
+    assert git_cat_blob(tmp_path, sha) == data
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_read_large_blob(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, packed: bool
+) -> None:
+    git_repo = Repo.init(tmp_path)
+    data = make_large_file(tmp_path / "large.bin")
+    sha = git_repo.git.hash_object("-w", tmp_path / "large.bin")
+    if packed:
+        git_repo.git.add("large.bin")
+        git_repo.index.commit("large")
+        git_repo.git.repack("-a", "-d")
+        git_repo.git.prune_packed()
+    repo = Repository(tmp_path)
+
+    fmt, size, chunks = read_object_stream(repo, sha)
+    streamed = list(chunks)
+    assert (fmt, size) == ("blob", len(data))
+    assert len(streamed) > 1
+    assert all(len(chunk) <= STREAM_CHUNK_SIZE for chunk in streamed)
+    assert b"".join(streamed) == git_cat_blob(tmp_path, sha)
+
+    checkout_blob(repo, sha, tmp_path / "out.bin")
+    assert (tmp_path / "out.bin").read_bytes() == data
+
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(main, ["cat-file", sha])
+    assert result.exit_code == 0
+    assert result.stdout_bytes == data
@@ -0,0 +1,99 @@
+from g1t.cmd import cmd_rev_parse
+from g1t.core.lookup import abbreviate_object, find_objects_by_prefix
+from g1t.core.object import find_object
+from g1t.core.repository import Repository
+from pathlib import Path
+from git import Repo
+from git.exc import GitCommandError
+import hashlib
+import pytest
+
+
+def blob_sha(content: str) -> str:
+    data = content.encode("utf8")
+    return hashlib.sha1(b"blob %d\x00" % len(data) + data).hexdigest()
+
+
+def write_blobs(repo: Repo, path: Path, contents: list[str]) -> list[str]:
+    files = []
+    for i, content in enumerate(contents):
+        files.append(path / f"blob{i}")
+        files[-1].write_text(content)
+    shas = repo.git.hash_object("-w", *files).splitlines()
+    for f in files:
+        f.unlink()
+    return shas
+
+
+def make_objects(path: Path) -> tuple[Repo, str, str]:
+    # Packed blobs, and loose ones, one of which shares its first four hex
+    # digits with a packed one. Returns that packed and loose pair.
+    repo = Repo.init(path)
+    packed = write_blobs(repo, path, [f"packed {i}\n" for i in range(300)])
+    repo.git.repack("-a", "-d")
+    repo.git.prune_packed()
+
+    by_prefix = {sha[:4]: sha for sha in packed}
+    contents = [f"loose {i}\n" for i in range(100)]
+    i = 0
+    while blob_sha(f"sharing {i}\n")[:4] not in by_prefix:
+        i += 1
+    contents.append(f"sharing {i}\n")
+    loose = write_blobs(repo, path, contents)[-1]
+    return repo, by_prefix[loose[:4]], loose
+
+
+def test_find_objects_by_prefix(tmp_path: Path) -> None:
+    repo, packed, loose = make_objects(tmp_path)
+    g1t_repo = Repository(tmp_path)
+
+    prefix = loose[:4]
+    found = find_objects_by_prefix(g1t_repo, prefix)
+    assert packed in found and loose in found
+    expected = repo.git.rev_parse(f"--disambiguate={prefix}").splitlines()
+    assert found == sorted(expected)
+    assert find_objects_by_prefix(g1t_repo, loose) == [loose]
+
+
+def test_find_object_ambiguous_prefix(tmp_path: Path) -> None:
+    repo, packed, loose = make_objects(tmp_path)
+    g1t_repo = Repository(tmp_path)
+
+    with pytest.raises(GitCommandError):
+        repo.git.rev_parse("--verify", loose[:4])
+    with pytest.raises(Exception, match="Ambiguous reference"):
+        find_object(g1t_repo, loose[:4])
+    unique = abbreviate_object(g1t_repo, loose, 4)
+    assert find_object(g1t_repo, unique) == loose
+    assert find_object(g1t_repo, abbreviate_object(g1t_repo, packed, 4)) == packed
+
+
+@pytest.mark.parametrize("min_length", [4, 7])
+def test_abbreviate_object(tmp_path: Path, min_length: int) -> None:
+    repo, packed, loose = make_objects(tmp_path)
+    g1t_repo = Repository(tmp_path)
+
+    # git rev-parse --short takes one object at a time: a sample of them,
+    # and the pair sharing a prefix.
+    shas = repo.git.cat_file("--batch-check", "--batch-all-objects").splitlines()
+    sample = [line.split(" ")[0] for line in shas[::10]] + [packed, loose]
+    for sha in sample:
+        short = abbreviate_object(g1t_repo, sha, min_length)
+        assert short == repo.git.rev_parse(f"--short={min_length}", sha)
+        assert find_objects_by_prefix(g1t_repo, short) == [sha]
+
+
+def test_cmd_rev_parse_short(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    repo, packed, loose = make_objects(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    for sha in (packed, loose):
+        expected = repo.git.rev_parse("--short=4", sha)
+        # Both need a fifth digit.
+        assert len(expected) > 4
+        assert cmd_rev_parse(sha, 4) == expected
+        assert capsys.readouterr().out == expected + "\n"
@@ -0,0 +1,47 @@
+import pytest
+from g1t.cmd import cmd_sparse_checkout_set, cmd_sparse_checkout_disable
+from pathlib import Path
+from git import Repo
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+def test_sparse_checkout() -> None:
+    repo = Repo(PROJECT_ROOT)
+    try:
+        cmd_sparse_checkout_set(["src"], sparse_index=True)
+        assert (PROJECT_ROOT / "src" / "g1t").exists()
+        assert not (PROJECT_ROOT / "bench").exists()
+        # Directories outside the cone are a single entry for their tree.
+        entries = repo.git.ls_files("-s", "--sparse").splitlines()
+        assert f"040000 {repo.head.commit.tree['bench'].hexsha} 0\tbench/" in entries
+        assert repo.git.status("--porcelain", "--untracked-files=no") == ""
+    finally:
+        cmd_sparse_checkout_disable()
+    assert (PROJECT_ROOT / "bench").exists()
+    assert repo.git.status("--porcelain", "--untracked-files=no") == ""
+
+
+def test_sparse_checkout_keeps_untracked_file(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    repo = Repo(PROJECT_ROOT)
+    path = PROJECT_ROOT / "bench" / "bench_index.py"
+    original = path.read_bytes()
+    try:
+        cmd_sparse_checkout_set(["src"], sparse_index=False)
+        assert not path.exists()
+        # An untracked file where a path outside the cone was.
+        path.parent.mkdir()
+        path.write_bytes(b"untracked\n")
+        cmd_sparse_checkout_disable()
+        assert "warning: not overwriting untracked bench/bench_index.py" in (
+            capsys.readouterr().err
+        )
+        assert path.read_bytes() == b"untracked\n"
+        assert repo.git.ls_files("-t", "bench").splitlines() == [
+            "S bench/bench_index.py"
+        ]
+    finally:
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(original)
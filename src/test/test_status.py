@@ -0,0 +1,102 @@
+from g1t.cmd.status import cmd_status, hash_file, index_worktree_changes
+from g1t.core.index import read_index
+from g1t.core.object import hash_object
+from g1t.core.repository import Repository
+from pathlib import Path
+from typing import Any, BinaryIO
+from git import Repo
+import g1t.cmd.status
+import g1t.core.index
+import os
+import pytest
+import time
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+
+def test_status_porcelain(capfdbinary: pytest.CaptureFixture[bytes]) -> None:
+    repo = Repo(PROJECT_ROOT)
+    with open(PROJECT_ROOT / "README.md", "a") as f:
+        f.write("status\n")
+    try:
+        for version in ("v1", "v2"):
+            cmd_status(porcelain=version, nul=True)
+            out, _ = capfdbinary.readouterr()
+            records = out.decode("utf8").split("\x00")[:-1]
+            tracked = [r for r in records if not r.startswith("?")]
+            expected = repo.git.status(
+                f"--porcelain={version}", "-z", "--untracked-files=no"
+            )
+            assert tracked and tracked == expected.split("\x00")[:-1]
+    finally:
+        repo.git.checkout("README.md")
+
+
+def test_status_hashes_touched_files_once(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capfdbinary: pytest.CaptureFixture[bytes],
+) -> None:
+    # Refreshed entries are not hashed again as racy when the index is
+    # written back.
+    repo = Repo.init(tmp_path)
+    names = [f"file{i}.txt" for i in range(20)]
+    for name in names:
+        (tmp_path / name).write_text(name)
+    repo.index.add(names)
+    repo.index.commit("files")
+    # Touched after the index was written: stat-dirty, and racy compared
+    # to the index as read, but unchanged.
+    future = time.time() + 10
+    for name in names:
+        os.utime(tmp_path / name, (future, future))
+
+    hashed: list[str] = []
+
+    def counting_hash_object(f: BinaryIO, fmt: str, repo: Any = None) -> str:
+        hashed.append(Path(f.name).name)
+        return hash_object(f, fmt, repo)
+
+    monkeypatch.setattr(g1t.cmd.status, "hash_object", counting_hash_object)
+    monkeypatch.setattr(g1t.core.index, "hash_object", counting_hash_object)
+    monkeypatch.chdir(tmp_path)
+    cmd_status()
+    capfdbinary.readouterr()
+
+    assert sorted(hashed) == sorted(names)
+
+
+def test_index_worktree_changes_order(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Hashes finishing out of order are still reported in index order.
+    repo = Repo.init(tmp_path)
+    names = [f"file{i}.txt" for i in range(8)]
+    for name in names:
+        (tmp_path / name).write_text(name)
+    repo.index.add(names)
+    future = time.time() + 10
+    for i, name in enumerate(names):
+        if i % 3 == 0:
+            (tmp_path / name).write_text(f"changed {name}")
+        os.utime(tmp_path / name, (future, future))
+    (tmp_path / "file5.txt").unlink()
+
+    def slow_hash_file(path: Path) -> str:
+        # The first files take the longest.
+        time.sleep(0.01 * (8 - int(path.stem[4:])))
+        return hash_file(path)
+
+    monkeypatch.setattr(g1t.cmd.status, "hash_file", slow_hash_file)
+    g1t_repo = Repository(tmp_path)
+    index = read_index(g1t_repo)
+    changes = index_worktree_changes(g1t_repo, index, workers=4)
+
+    assert [(name, state) for name, _, state in changes] == [
+        ("file0.txt", "M"),
+        ("file3.txt", "M"),
+        ("file5.txt", "D"),
+        ("file6.txt", "M"),
+    ]
+    # Unchanged files got their stat data refreshed.
+    assert index.by_name["file1.txt"].mtime[0] == int(future)
@@ -0,0 +1,23 @@
+from g1t.core.utils import walk_worktree
+from pathlib import Path
+from git import Repo
+
+NAMES = ["a-b/c", "a.txt", "a/x", "a/y/z", "a0", "build.txt", "top"]
+
+
+def test_walk_worktree(tmp_path: Path) -> None:
+    Repo.init(tmp_path)
+    for name in NAMES + ["build/out.o", "a/build/out.o"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(name)
+    asked: list[str] = []
+
+    def is_ignored(path: str) -> bool:
+        asked.append(path)
+        return path.endswith("build/")
+
+    walked = [name for name, _ in walk_worktree(tmp_path, is_ignored)]
+
+    # In path order, as git sorts it, without .git and ignored directories.
+    assert walked == sorted(walked) == NAMES
+    assert sorted(asked) == ["a-b/", "a/", "a/build/", "a/y/", "build/"]